@@ -0,0 +1,8 @@
+import wshom
+import logging
+
+logging.basicConfig(level=logging.DEBUG)
+
+# Run every 30 minutes to arrange each timezone around its own evening
+a = wshom.create_app()
+wshom.arrange_due_shards(a)
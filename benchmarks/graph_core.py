@@ -0,0 +1,71 @@
+import networkx as nx
+import argparse
+import random
+import time
+import tracemalloc
+import wshom.csr
+import wshom.graph
+
+# Times one scheduling day (increment, filter, grouping, zeroing) and
+# measures the graph's memory on the networkx helpers in wshom.graph and on
+# the array-backed graph in wshom.csr.
+# Run with python -m benchmarks.graph_core
+
+def make_graph(n_users, seed):
+    rng = random.Random(seed)
+    g = nx.powerlaw_cluster_graph(n_users, 3, 0.3, seed=seed)
+    for n in g.nodes:
+        g.nodes[n].update(min_interval=rng.randint(3, 12), points=rng.randint(0, 12))
+    nx.set_edge_attributes(g, {e: {"points": rng.randint(0, 12)} for e in g.edges})
+    return g
+
+def networkx_day(g, size):
+    wshom.graph.increment_points(g)
+    eg = wshom.graph.without_ineligible(g)
+    groupings = wshom.graph.get_groupings(eg, size)
+    for group in groupings:
+        wshom.graph.zero_points(g, group)
+    return groupings
+
+def csr_day(g, size):
+    wshom.csr.increment_points(g)
+    eg = wshom.csr.without_ineligible(g)
+    groupings = wshom.csr.get_groupings(eg, size)
+    for group in groupings:
+        wshom.csr.zero_points(g, group)
+    return groupings
+
+def measure(build, day, size, days):
+    tracemalloc.start()
+    g = build()
+    graph_memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    groupings = [day(g, size) for _ in range(days)]
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return groupings, graph_memory, peak, elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the networkx and CSR graph cores")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--days", type=int, default=3)
+    parser.add_argument("--group-size", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    for n_users in args.sizes:
+        g = make_graph(n_users, args.seed)
+        results = {}
+        for name, build, day in [
+                ("networkx", lambda: g.copy(), networkx_day),
+                ("csr", lambda: wshom.csr.from_networkx(g), csr_day)]:
+            groupings, graph_memory, peak, elapsed = measure(build, day, args.group_size, args.days)
+            results[name] = groupings
+            print("{} users, {}: graph {:.1f} MiB, peak during days {:.1f} MiB, {:.3f}s for {} days".format(
+                n_users, name, graph_memory / 2**20, peak / 2**20, elapsed, args.days))
+        assert results["networkx"] == results["csr"]
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import networkx as nx
+import argparse
+import os
+import random
+import tempfile
+import time
+import sqlalchemy
+import wshom
+import wshom.config
+import wshom.graph
+import wshom.snapshot
+from wshom.model import User, GraphNode, GraphEdge, friendship
+from wshom.extensions import db
+
+# Seeds SQLite databases of several sizes and times graph_from_database
+# against the per-user loader it replaced, counting the queries each issues,
+# and times loading the same graph from a wshom.snapshot.
+# Run with python -m benchmarks.graph_load
+
+def orm_graph_from_database(app, day):
+    g = nx.DiGraph()
+    for user, graph_node in db.session.query(User, GraphNode).outerjoin(GraphNode).filter(User.active == True):
+        g.add_node(user.id, min_interval=user.min_interval, points=(day - graph_node.last_day if graph_node is not None else 1))
+        for friend in user.friends:
+            g.add_edge(user.id, friend.id, points=1)
+
+    single_edges = [(u, v) for (u, v) in g.edges if not g.has_edge(v, u)]
+    g.remove_edges_from(single_edges)
+    g = g.to_undirected()
+    # The old loader also left inactive friends behind as nodes without
+    # attributes; drop them so the results can be compared.
+    g.remove_nodes_from([n for n in list(g.nodes) if "min_interval" not in g.nodes[n]])
+
+    for graph_edge in GraphEdge.query:
+        edge_pair = (graph_edge.user_a_id, graph_edge.user_b_id)
+        if edge_pair in g.edges:
+            g.add_edge(*edge_pair, points=day - graph_edge.last_day)
+    return g
+
+def seed_database(n_users, seed, day):
+    rng = random.Random(seed)
+    fg = nx.powerlaw_cluster_graph(n_users, 4, 0.3, seed=seed)
+    db.session.execute(User.__table__.insert(), [{
+        "id": n + 1,
+        "username": "user{}".format(n),
+        "email": "user{}@example.com".format(n),
+        "password_hash": "",
+        "active": rng.random() > 0.05,
+        "display_name": "",
+        "timezone": "",
+        "min_interval": rng.randint(3, 12),
+    } for n in fg.nodes])
+    rows = []
+    for u, v in fg.edges:
+        rows.append({"user_id": u + 1, "friend_id": v + 1})
+        if rng.random() > 0.1:
+            rows.append({"user_id": v + 1, "friend_id": u + 1})
+    db.session.execute(friendship.insert(), rows)
+    db.session.execute(GraphNode.__table__.insert(), [{"user_id": n + 1, "last_day": day - rng.randint(0, 10)} for n in fg.nodes if rng.random() > 0.2])
+    db.session.execute(GraphEdge.__table__.insert(), [{"user_a_id": u + 1, "user_b_id": v + 1, "last_day": day - rng.randint(0, 10)} for (u, v) in fg.edges if rng.random() > 0.2])
+    db.session.commit()
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark graph_from_database")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    for n_users in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            wshom.config.Config.SQLALCHEMY_DATABASE_URI = "sqlite:///" + os.path.join(tmp, "bench.db")
+            app = wshom.create_app()
+            wshom.create_db(app)
+
+            with app.app_context():
+                day = wshom.graph.today()
+                seed_database(n_users, args.seed, day)
+
+                queries = [0]
+                def count(*_):
+                    queries[0] += 1
+                sqlalchemy.event.listen(db.engine, "before_cursor_execute", count)
+
+                results = []
+                for loader in (orm_graph_from_database, wshom.graph.graph_from_database):
+                    db.session.expire_all()
+                    queries[0] = 0
+                    start = time.perf_counter()
+                    g = loader(app, day)
+                    elapsed = time.perf_counter() - start
+                    results.append(g)
+                    print("{} users, {}: {:.3f}s, {} queries".format(n_users, loader.__name__, elapsed, queries[0]))
+
+                old, new = results
+                assert {n: (d["min_interval"], d["points"]) for (n, d) in old.nodes(data=True)} == {n: (d["min_interval"], d["points"]) for (n, d) in new.nodes(data=True)}
+                assert {frozenset(e): p for (*e, p) in old.edges(data="points")} == {frozenset(e): p for (*e, p) in new.edges(data="points")}
+                sqlalchemy.event.remove(db.engine, "before_cursor_execute", count)
+
+                path = os.path.join(tmp, "bench.snapshot")
+                wshom.snapshot.export_snapshot(app, path, day)
+                start = time.perf_counter()
+                cg = wshom.snapshot.load(path)
+                elapsed = time.perf_counter() - start
+                print("{} users, snapshot ({} bytes): {:.3f}s".format(n_users, os.path.getsize(path), elapsed))
+                loaded = wshom.csr.to_networkx(cg)
+                assert {frozenset(e): p for (*e, p) in loaded.edges(data="points")} == {frozenset(e): p for (*e, p) in new.edges(data="points")}
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+import networkx as nx
+import argparse
+import itertools
+import random
+import time
+import wshom.search
+
+# Compares the branch-and-bound group search against the brute-force
+# combinations scorer it replaced, on synthetic friend graphs.
+
+def brute_force_best_group(g, edge, size):
+    nodes = wshom.search.candidate_nodes(g, edge, size)
+    combos = (set(edge) | set(c) for c in itertools.combinations(nodes, size - 2))
+    combo_graphs = (g.subgraph(c) for c in combos)
+
+    def score(gg):
+        if not nx.is_k_edge_connected(gg, 2):
+            return None
+        return sum(nx.get_edge_attributes(gg, "points").values())
+
+    scores = ((c, score(c)) for c in combo_graphs)
+    scores = ((c, s) for (c, s) in scores if s is not None)
+    best_group, best_score = max(scores, key=lambda x: x[1], default=(None, None))
+    if best_group is None:
+        return None, None
+    return set(best_group.nodes), best_score
+
+def make_graph(n_users, seed):
+    g = nx.powerlaw_cluster_graph(n_users, 3, 0.3, seed=seed)
+    rng = random.Random(seed)
+    nx.set_edge_attributes(g, {e: {"points": rng.randint(0, 10)} for e in g.edges})
+    return g
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark group search (run with python -m benchmarks.group_search)")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 5000, 20000, 50000])
+    parser.add_argument("--edges", type=int, default=20, help="Seed edges sampled per graph")
+    parser.add_argument("--group-size", type=int, default=4)
+    parser.add_argument("--max-candidates", type=int, default=150, help="Skip brute force on larger neighborhoods")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    for n_users in args.sizes:
+        g = make_graph(n_users, args.seed)
+        rng = random.Random(args.seed)
+        edges = rng.sample(list(g.edges), args.edges)
+
+        search_time = 0
+        brute_time = 0
+        compared = 0
+        for edge in edges:
+            start = time.perf_counter()
+            result = wshom.search.best_group(g, edge, args.group_size)
+            search_time += time.perf_counter() - start
+
+            if len(wshom.search.candidate_nodes(g, edge, args.group_size)) > args.max_candidates:
+                continue
+            start = time.perf_counter()
+            expected = brute_force_best_group(g, edge, args.group_size)
+            brute_time += time.perf_counter() - start
+            assert result == expected, "Mismatch on {}: {} != {}".format(edge, result, expected)
+            compared += 1
+
+        print("{} users: search {:.3f}s over {} edges, brute force {:.3f}s over {} edges".format(
+            n_users, search_time, len(edges), brute_time, compared))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+import argparse
+import os
+import tempfile
+import threading
+import time
+import wshom
+import wshom.config
+import wshom.passwords
+from wshom.model import User
+from wshom.extensions import db
+
+# Load test for logins: several clients log in as fast as they can while
+# another loads / and an attacker keeps guessing one user's password. Reports
+# login throughput and latency, 503s from admission control, 429s from the
+# failure throttle, and how long / takes meanwhile, for each pool size
+# (0 hashes on the request threads, as before wshom.passwords).
+# Run with python -m benchmarks.logins
+
+PASSWORD = "correct horse"
+
+def seed(app, n_users):
+    with app.app_context():
+        # Every user gets the same hash, made once
+        password_hash = wshom.passwords.hash_password(PASSWORD)
+        db.session.execute(User.__table__.insert(), [
+            {"id": i + 1, "username": "user{}".format(i), "email": "user{}@example.com".format(i),
+             "password_hash": password_hash, "active": True, "display_name": "", "timezone": "", "min_interval": 5}
+            for i in range(n_users)])
+        db.session.commit()
+
+def percentile(values, p):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+def run(app, n_users, clients, duration):
+    stop = threading.Event()
+    logins = []
+    statuses = []
+    index_times = []
+    attacker_statuses = []
+    lock = threading.Lock()
+
+    def login_client(k):
+        client = app.test_client()
+        i = k
+        while not stop.is_set():
+            start = time.perf_counter()
+            r = client.post("/login", data={"username": "user{}".format(i % n_users), "password": PASSWORD})
+            elapsed = time.perf_counter() - start
+            with lock:
+                statuses.append(r.status_code)
+                if r.status_code == 302:
+                    logins.append(elapsed)
+            client.post("/logout")
+            i += clients
+
+    def index_client():
+        client = app.test_client()
+        while not stop.is_set():
+            start = time.perf_counter()
+            client.get("/")
+            index_times.append(time.perf_counter() - start)
+            time.sleep(0.01)
+
+    def attacker():
+        client = app.test_client()
+        while not stop.is_set():
+            r = client.post("/login", data={"username": "user0", "password": "guess"})
+            attacker_statuses.append(r.status_code)
+
+    threads = [threading.Thread(target=login_client, args=(k,)) for k in range(clients)]
+    threads += [threading.Thread(target=index_client), threading.Thread(target=attacker)]
+    for t in threads:
+        t.start()
+    time.sleep(duration)
+    stop.set()
+    for t in threads:
+        t.join()
+
+    return {
+        "logins_per_second": len(logins) / duration,
+        "login_p50": percentile(logins, 50),
+        "login_p99": percentile(logins, 99),
+        "busy": statuses.count(503),
+        "index_p50": percentile(index_times, 50),
+        "index_p99": percentile(index_times, 99),
+        "attacker_attempts": len(attacker_statuses),
+        "attacker_throttled": attacker_statuses.count(429),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test concurrent logins")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--clients", type=int, default=16, help="Threads logging in at once")
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 2, 4], help="PASSWORD_HASH_WORKERS to try")
+    parser.add_argument("--queue", type=int, default=16, help="PASSWORD_HASH_QUEUE")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds per run")
+    args = parser.parse_args()
+
+    for workers in args.workers:
+        with tempfile.TemporaryDirectory() as d:
+            wshom.config.Config.SQLALCHEMY_DATABASE_URI = "sqlite:///" + os.path.join(d, "wshom.db")
+            wshom.config.Config.PASSWORD_HASH_WORKERS = workers
+            wshom.config.Config.PASSWORD_HASH_QUEUE = args.queue
+            app = wshom.create_app()
+            app.config["WTF_CSRF_ENABLED"] = False
+            wshom.create_db(app)
+            seed(app, args.users)
+
+            r = run(app, args.users, args.clients, args.duration)
+            with app.app_context():
+                wshom.passwords.hasher().shutdown()
+            print("{} workers: {:.1f} logins/s, login p50 {:.3f}s p99 {:.3f}s, {} busy, / p50 {:.3f}s p99 {:.3f}s, attacker {}/{} throttled".format(
+                workers, r["logins_per_second"], r["login_p50"], r["login_p99"], r["busy"],
+                r["index_p50"], r["index_p99"], r["attacker_throttled"], r["attacker_attempts"]))
+
+if __name__ == "__main__":
+    main()
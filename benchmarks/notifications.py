@@ -0,0 +1,136 @@
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import threading
+import time
+import wshom
+import wshom.config
+import wshom.outbox
+from wshom.model import User, Notification
+from wshom.extensions import db
+
+# Measures how fast wshom.outbox.dispatch drains the notification outbox into
+# a local SMTP stand-in, for several batch sizes and concurrencies.
+# Run with python -m benchmarks.notifications
+
+class SMTPSink:
+    """A minimal SMTP server that accepts and counts messages, on its own
+    thread. With fail_rate, that fraction of messages is refused with a
+    temporary error.
+    """
+
+    def __init__(self, fail_rate=0, delay=0, seed=0):
+        self.fail_rate = fail_rate
+        self.delay = delay
+        self.rng = random.Random(seed)
+        self.received = 0
+        self.refused = 0
+        self.message_ids = set()
+        self.ready = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        self.ready.wait()
+        return self.port
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.server.close)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        self.server = self.loop.run_until_complete(asyncio.start_server(self._session, "127.0.0.1", 0))
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.ready.set()
+        self.loop.run_forever()
+
+    async def _session(self, reader, writer):
+        writer.write(b"220 sink ESMTP\r\n")
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            command = line[:4].upper()
+            if command in (b"EHLO", b"HELO"):
+                writer.write(b"250 sink\r\n")
+            elif command == b"DATA":
+                writer.write(b"354 go ahead\r\n")
+                await writer.drain()
+                message_id = None
+                while True:
+                    data = await reader.readline()
+                    if data in (b".\r\n", b""):
+                        break
+                    if data.lower().startswith(b"message-id:"):
+                        message_id = data.split(b":", 1)[1].strip()
+                if self.delay:
+                    await asyncio.sleep(self.delay)
+                if self.rng.random() < self.fail_rate:
+                    self.refused += 1
+                    writer.write(b"451 try again later\r\n")
+                else:
+                    self.received += 1
+                    self.message_ids.add(message_id)
+                    writer.write(b"250 queued\r\n")
+            elif command == b"QUIT":
+                writer.write(b"221 bye\r\n")
+                await writer.drain()
+                break
+            else:
+                # MAIL, RCPT, RSET, NOOP
+                writer.write(b"250 ok\r\n")
+            await writer.drain()
+        writer.close()
+
+def seed(app, n_users, day):
+    with app.app_context():
+        db.session.execute(User.__table__.insert(), [
+            {"id": i + 1, "username": "user{}".format(i + 1), "email": "user{}@example.com".format(i + 1),
+             "password_hash": "", "active": True, "display_name": "", "timezone": "", "min_interval": 5}
+            for i in range(n_users)])
+        ids = list(range(1, n_users + 1))
+        groupings = [set(ids[i:i + 4]) for i in range(0, n_users - 3, 4)]
+        wshom.outbox.enqueue_hangouts(day, groupings)
+        db.session.commit()
+        # A second run of the same day must not queue anything more
+        wshom.outbox.enqueue_hangouts(day, groupings)
+        db.session.commit()
+        return Notification.query.count()
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark draining the notification outbox")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[50, 200])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--fail-rate", type=float, default=0, help="Fraction of sends the sink refuses")
+    parser.add_argument("--delay", type=float, default=0.002, help="Seconds the sink takes per message")
+    args = parser.parse_args()
+
+    for batch_size in args.batch_sizes:
+        for concurrency in args.concurrency:
+            with tempfile.TemporaryDirectory() as d:
+                wshom.config.Config.SQLALCHEMY_DATABASE_URI = "sqlite:///" + os.path.join(d, "wshom.db")
+                app = wshom.create_app()
+                wshom.create_db(app)
+                queued = seed(app, args.users, 1)
+
+                sink = SMTPSink(args.fail_rate, args.delay)
+                app.config.update(MAIL_SERVER="127.0.0.1", MAIL_PORT=sink.start(),
+                                  NOTIFY_BATCH_SIZE=batch_size, NOTIFY_CONCURRENCY=concurrency,
+                                  NOTIFY_RETRY_DELAY=0)
+                start = time.perf_counter()
+                with app.app_context():
+                    sent, failed = asyncio.run(wshom.outbox.dispatch(app))
+                elapsed = time.perf_counter() - start
+                sink.stop()
+
+                assert sink.received == sent == len(sink.message_ids)
+                print("batch {}, {} connections: {} queued, {} sent, {} failed, {} refused, {:.0f} messages/s".format(
+                    batch_size, concurrency, queued, sent, failed, sink.refused, sent / elapsed))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+import networkx as nx
+import argparse
+import importlib
+import json
+import platform
+import random
+import resource
+import subprocess
+import time
+import tracemalloc
+import friend_graph
+
+# Headless, seeded simulation benchmark built on friend_graph.simulate_days.
+#
+# Runs each generator at each size for a number of simulated days and reports
+# time per phase, peak memory, groups formed and fairness of the hangout
+# counts as JSON, so runs can be compared between commits:
+#
+#     python -m benchmarks.simulate --output before.json
+#     python -m benchmarks.simulate --output after.json --compare before.json
+
+def hub_spoke(n_users, rng):
+    """Hubs with a handful of spokes each, the spokes loosely linked to each other."""
+    g = nx.Graph()
+    g.add_nodes_from(range(n_users))
+    hubs = max(1, n_users // 10)
+    for spoke in range(hubs, n_users):
+        for hub in rng.sample(range(hubs), min(hubs, 2)):
+            g.add_edge(hub, spoke)
+        g.add_edge(spoke, rng.randrange(hubs, n_users))
+    g.remove_edges_from(nx.selfloop_edges(g))
+    return g
+
+def complete(n_users, rng):
+    """Disjoint cliques of 4 to 8 friends."""
+    g = nx.Graph()
+    start = 0
+    while start < n_users:
+        members = range(start, min(n_users, start + rng.randint(4, 8)))
+        g.add_nodes_from(members)
+        g.add_edges_from((a, b) for a in members for b in members if a < b)
+        start = members.stop
+    return g
+
+def power_law(n_users, rng):
+    return nx.powerlaw_cluster_graph(n_users, 3, 0.3, seed=rng.randrange(2**32))
+
+def small_world(n_users, rng):
+    return nx.connected_watts_strogatz_graph(n_users, 6, 0.1, seed=rng.randrange(2**32))
+
+GENERATORS = {
+    "hub-spoke": hub_spoke,
+    "complete": complete,
+    "power-law": power_law,
+    "small-world": small_world,
+}
+
+def csr_grouper(g):
+    import wshom.csr
+    return wshom.csr.get_groupings(wshom.csr.from_networkx(g))
+
+ALGORITHMS = {
+    "greedy": friend_graph.get_groupings,
+    "csr": csr_grouper,
+}
+
+def load_algorithm(name):
+    """An ALGORITHMS name, or module:function for a grouper(g) -> groups."""
+    if name in ALGORITHMS:
+        return ALGORITHMS[name]
+    module, _, function = name.partition(":")
+    return getattr(importlib.import_module(module), function)
+
+def run(generator, n_users, seed, algorithm, days, prune, trace_memory):
+    rng = random.Random(seed)
+    g = GENERATORS[generator](n_users, rng)
+    nx.set_node_attributes(g, {n: {"min_interval": rng.randint(5, 8)} for n in g.nodes})
+
+    timings = {}
+    if trace_memory:
+        tracemalloc.start()
+    hangouts = friend_graph.HangoutCounts(g.nodes)
+    wait_times = friend_graph.WaitTimes()
+    groups_formed = 0
+    start = time.perf_counter()
+    ug = friend_graph.prepare(g, prune, timings)
+    for _, groupings in friend_graph.simulate_days(ug, days, load_algorithm(algorithm), timings, [hangouts, wait_times]):
+        groups_formed += len(groupings)
+    wall_time = time.perf_counter() - start
+    peak = None
+    if trace_memory:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    hangouts = hangouts.result()
+    return {
+        "generator": generator,
+        "users": n_users,
+        "edges": g.number_of_edges(),
+        "seed": seed,
+        "algorithm": algorithm,
+        "days": days,
+        "wall_time": wall_time,
+        "phases": timings,
+        "peak_traced_memory": peak,
+        "groups_formed": groups_formed,
+        "hangouts_per_user": friend_graph.fairness(list(hangouts.values())),
+        "hangouts_per_schedulable_user": friend_graph.fairness([hangouts[n] for n in ug.nodes]),
+        "days_between_hangouts": wait_times.result(),
+    }
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(report, baseline):
+    def key(r):
+        return (r["generator"], r["users"], r["seed"], r["algorithm"], r["days"])
+    old = {key(r): r for r in baseline["runs"]}
+    for r in report["runs"]:
+        b = old.get(key(r))
+        if b is None:
+            continue
+        print("{generator} {users} users, {algorithm}: {wall_time:.3f}s".format(**r)
+            + " vs {:.3f}s ({:+.1%}), groups {} vs {}".format(
+                b["wall_time"], r["wall_time"] / b["wall_time"] - 1 if b["wall_time"] else 0,
+                r["groups_formed"], b["groups_formed"]))
+
+def main():
+    parser = argparse.ArgumentParser(description="Seeded hangout simulation benchmark")
+    parser.add_argument("--generators", nargs="+", default=list(GENERATORS), choices=list(GENERATORS))
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000])
+    parser.add_argument("--seeds", type=int, nargs="+", default=[0])
+    parser.add_argument("--algorithms", nargs="+", default=["greedy"], help="Names from ALGORITHMS or module:function")
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--no-prune", action="store_true", help="Skip the isolated edge pre-pass")
+    parser.add_argument("--trace-memory", action="store_true", help="Report peak memory with tracemalloc (slow)")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    parser.add_argument("--compare", help="JSON report to compare this run against")
+    args = parser.parse_args()
+
+    runs = []
+    for generator in args.generators:
+        for n_users in args.sizes:
+            for seed in args.seeds:
+                for algorithm in args.algorithms:
+                    runs.append(run(generator, n_users, seed, algorithm, args.days, not args.no_prune, args.trace_memory))
+
+    report = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "networkx": nx.__version__,
+        "max_rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "runs": runs,
+    }
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+from benchmarks.simulate import git_revision
+
+# Cold start benchmark: times importing wshom and creating the app in fresh
+# interpreters, reports the slowest imports from python -X importtime, and
+# checks which heavy modules a web worker ends up loading. Reports are JSON,
+# so runs can be compared between commits:
+#
+#     python -m benchmarks.startup --output before.json
+#     python -m benchmarks.startup --output after.json --compare before.json
+
+SCENARIOS = {
+    "web": "import wshom; wshom.create_app()",
+    "scheduler": "import wshom; wshom.create_app(); import wshom.graph",
+}
+
+# Modules web workers shouldn't need to import
+HEAVY_MODULES = ["networkx", "numpy", "pytz", "pkg_resources"]
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+{}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "loaded": [m for m in {} if m in sys.modules]}}))
+"""
+
+def run_once(code):
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", PROBE.format(code, json.dumps(HEAVY_MODULES))],
+                            capture_output=True, text=True, check=True)
+    probe = json.loads(result.stdout.strip().splitlines()[-1])
+
+    # Lines look like "import time: self [us] | cumulative | imported package",
+    # with nested imports indented under the package
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not name.startswith("  "):
+            imports.append((name.strip(), int(cumulative) / 1e6))
+    return probe, imports
+
+def run(name, repeat, top):
+    times = []
+    for _ in range(repeat):
+        probe, imports = run_once(SCENARIOS[name])
+        times.append(probe["seconds"])
+    imports.sort(key=lambda i: i[1], reverse=True)
+    return {
+        "scenario": name,
+        "repeat": repeat,
+        "median": statistics.median(times),
+        "min": min(times),
+        "loaded_heavy_modules": probe["loaded"],
+        "slowest_top_level_imports": [{"module": m, "seconds": s} for (m, s) in imports[:top]],
+    }
+
+def compare(report, baseline):
+    old = {r["scenario"]: r for r in baseline["runs"]}
+    for r in report["runs"]:
+        b = old.get(r["scenario"])
+        if b is None:
+            continue
+        print("{}: {:.3f}s vs {:.3f}s ({:+.1%})".format(r["scenario"], r["median"], b["median"], r["median"] / b["median"] - 1))
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark importing wshom and creating the app")
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument("--repeat", type=int, default=10, help="Fresh interpreters per scenario")
+    parser.add_argument("--top", type=int, default=10, help="How many of the slowest imports to list")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    parser.add_argument("--compare", help="JSON report to compare this run against")
+    args = parser.parse_args()
+
+    report = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "runs": [run(name, args.repeat, args.top) for name in args.scenarios],
+    }
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,4 @@
+import wshom
+
+a = wshom.create_app()
+wshom.build_group_index(a)
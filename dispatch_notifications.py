@@ -0,0 +1,7 @@
+import wshom
+import logging
+
+logging.basicConfig(level=logging.INFO)
+
+a = wshom.create_app()
+wshom.dispatch_notifications(a)
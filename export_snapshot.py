@@ -0,0 +1,5 @@
+import sys
+import wshom
+
+a = wshom.create_app()
+wshom.export_snapshot(a, sys.argv[1] if len(sys.argv) > 1 else "wshom.snapshot")
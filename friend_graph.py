@@ -1,6 +1,14 @@
 import networkx as nx
+import contextlib
 import logging
-import itertools
+import os
+import pickle
+import statistics
+import time
+import wshom.search
+import wshom.pruning
+import wshom.metrics
+import wshom.snapshot
 
 logger = logging.getLogger(__name__)
 
@@ -28,109 +36,243 @@ def without_ineligible(g):
     return g
 
 def get_isolated(g, size=4):
+    removed_edges = set(wshom.pruning.unusable_edges(list(g.edges), size))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("These edges will never be used: {}".format(repr(removed_edges)))
     g = g.copy()
-    removed_edges = set()
-    while True:
-        newly_isolated = [e for e in g.edges if not get_best_group(g, e, size, return_exists=True)]
-        if not newly_isolated:
-            break
-        logger.debug("These edges will never be used: {}".format(repr(newly_isolated)))
-        g.remove_edges_from(newly_isolated)
-        removed_edges = removed_edges.union(newly_isolated)
+    g.remove_edges_from(removed_edges)
     return list(nx.isolates(g)), removed_edges
 
 def get_best_group(g, edge, size, return_exists=False):
-    logger.debug("Get best group for {}".format(repr(edge)))
-    max_depth = size - 1
-    (n1, n2) = [nx.bfs_tree(g, n, depth_limit=max_depth - 1).nodes for n in edge]
-    nodes = set(n1).union(n2)
-    nodes -= set(edge)
-    combos = (set(edge) | set(c) for c in itertools.combinations(nodes, size - 2))
-    combo_graphs = (g.subgraph(c) for c in combos)
-
-    def score(gg):
-        if not nx.is_k_edge_connected(gg, 2):
-            return None
-        #return sum(sorted(nx.get_edge_attributes(g, "points").values())[-4:])
-        return sum(nx.get_edge_attributes(g, "points").values())
-
-    scores = ((c, score(c)) for c in combo_graphs)
-    scores = ((c, s) for (c, s) in scores if s is not None)
-
+    debug = logger.isEnabledFor(logging.DEBUG)
+    if debug:
+        logger.debug("Get best group for {}".format(repr(edge)))
     if return_exists:
-        return any(True for _ in scores)
-
-    scores = list(scores)
-    logger.debug("Found {} valid groups of {}".format(len(scores), size))
-    best_group, best_score = max(scores, key=lambda x: x[1], default=(None, None))
+        return wshom.search.group_exists(g, edge, size)
 
-    if best_group is not None:
+    best_group, best_score = wshom.search.best_group(g, edge, size)
+    if debug and best_group is not None:
         logger.debug("Chosen group has score {}".format(best_score))
-        return set(best_group.nodes)
-    else:
-        return None
+    return best_group
 
 def get_groupings(g, size=4):
+    debug = logger.isEnabledFor(logging.DEBUG)
     orig_size = len(g.nodes)
     g = g.copy()
     groupings = []
-    while True:
-        if not g.edges:
-            break
-        # Find edge with highest points
-        starting_edge, starting_points = max(nx.get_edge_attributes(g, "points").items(), key=lambda x: x[1])
-        logger.debug("Starting edge is {} with {} points".format(starting_edge, starting_points))
+    # Edges come off the queue highest points first; the ones that lost an
+    # endpoint to an earlier group are skipped when popped.
+    for starting_edge, starting_points in wshom.search.edges_by_points(g):
+        if debug:
+            logger.debug("Starting edge is {} with {} points".format(starting_edge, starting_points))
         group = get_best_group(g, starting_edge, size)
         if group:
-            logger.debug("Formed a group: {}".format(group))
+            if debug:
+                logger.debug("Formed a group: {}".format(group))
             groupings.append(group)
             g.remove_nodes_from(group)
         else:
-            logger.debug("Failed to make a group")
+            if debug:
+                logger.debug("Failed to make a group")
             g.remove_edge(*starting_edge)
-    logger.debug("Was able to put {} / {} eligible people into groups".format(orig_size - len(g.nodes), orig_size))
+    if debug:
+        logger.debug("Was able to put {} / {} eligible people into groups".format(orig_size - len(g.nodes), orig_size))
     return groupings
 
-def simulate(g, steps=100):
+@contextlib.contextmanager
+def _phase(timings, name):
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0) + time.perf_counter() - start
+
+def prepare(g, prune=True, timings=None):
+    """The graph simulate_days runs on: g made undirected, without the nodes
+    and edges that can never be in a group if prune, with points zeroed.
+    """
+    debug = logger.isEnabledFor(logging.DEBUG)
     ug = to_undirected(g)
-    isolates, isolated_edges = get_isolated(ug)
-    logger.debug("{} / {} nodes are isolated: {}".format(len(isolates), len(ug.nodes), ", ".join([repr(n) for n in isolates])))
-    ug.remove_nodes_from(isolates)
-    remaining_edges = isolated_edges.intersection(ug.edges)
-    logger.debug("{} edges are isolated: {}".format(len(remaining_edges), ", ".join([repr(n) for n in remaining_edges])))
-    ug.remove_edges_from(isolated_edges)
+    if prune:
+        with _phase(timings, "prune"):
+            isolates, isolated_edges = get_isolated(ug)
+        if debug:
+            logger.debug("{} / {} nodes are isolated: {}".format(len(isolates), len(ug.nodes), ", ".join([repr(n) for n in isolates])))
+        ug.remove_nodes_from(isolates)
+        remaining_edges = isolated_edges.intersection(ug.edges)
+        if debug:
+            logger.debug("{} edges are isolated: {}".format(len(remaining_edges), ", ".join([repr(n) for n in remaining_edges])))
+        ug.remove_edges_from(isolated_edges)
 
     zero_points(ug)
+    return ug
 
-    import matplotlib.pyplot as plt
-    nx.draw(ug, with_labels=True)
-    plt.show()
+def simulate_days(ug, steps=100, grouper=get_groupings, timings=None, aggregators=(), start=0,
+                  checkpoint=None, checkpoint_every=100):
+    """Runs the scheduler on ug (from prepare) for days start to steps - 1,
+    yielding (day, groupings) as each day is done. ug is updated as it goes.
 
-    results = []
+    grouper(eg) returns the day's groups for the eligible graph eg. Each
+    aggregator's add(day, groupings) is called with every day's groups. If
+    timings is a dict, it accumulates seconds spent in each phase.
 
-    i = 0
-    for i in range(steps):
-        logger.debug("Step {}".format(i))
-        increment_points(ug)
-        eg = without_ineligible(ug)
+    With checkpoint, ug, the next day and the aggregators are saved to that
+    path every checkpoint_every days and after the last; load_checkpoint
+    gives back what's needed to carry on.
+    """
+    debug = logger.isEnabledFor(logging.DEBUG)
+    for i in range(start, steps):
+        if debug:
+            logger.debug("Step {}".format(i))
+        with _phase(timings, "increment"):
+            increment_points(ug)
+        with _phase(timings, "filter"):
+            eg = without_ineligible(ug)
         if eg.nodes:
-            groupings = get_groupings(eg)
-            for group in groupings:
-                logger.debug(", ".join([repr(n) for n in group]) + " should hang out")
-                zero_points(ug, group)
+            with _phase(timings, "grouping"):
+                groupings = grouper(eg)
+            with _phase(timings, "zero"):
+                for group in groupings:
+                    if debug:
+                        logger.debug(", ".join([repr(n) for n in group]) + " should hang out")
+                    zero_points(ug, group)
         else:
             groupings = []
-        results.append(groupings)
 
-        #print(nx.get_node_attributes(eg, "points"))
-        #print(nx.get_edge_attributes(eg, "points"))
+        for aggregator in aggregators:
+            aggregator.add(i, groupings)
+        if checkpoint is not None and ((i + 1) % checkpoint_every == 0 or i + 1 == steps):
+            with _phase(timings, "checkpoint"):
+                save_checkpoint(checkpoint, ug, i + 1, aggregators)
+        yield i, groupings
 
+def simulate(g, steps=100, grouper=get_groupings, prune=True, timings=None):
+    """Runs the scheduler on g for steps days.
+
+    Returns the final graph and a list of every day's groups. See prepare and
+    simulate_days to handle the days as they come instead.
+    """
+    ug = prepare(g, prune, timings)
+    results = [groupings for (_, groupings) in simulate_days(ug, steps, grouper, timings)]
     return ug, results
 
+def save_checkpoint(path, ug, day, aggregators=()):
+    """Saves a simulation's state, replacing any earlier checkpoint at path
+    only once the new one is complete.
+    """
+    tmp_path = "{}.tmp{}".format(path, os.getpid())
+    with open(tmp_path, "wb") as f:
+        pickle.dump({"graph": ug, "day": day, "aggregators": list(aggregators)}, f, pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+def load_checkpoint(path):
+    """Returns (ug, start, aggregators) to pass back to simulate_days."""
+    with open(path, "rb") as f:
+        state = pickle.load(f)
+    return state["graph"], state["day"], state["aggregators"]
+
+# Aggregators for simulate_days. Each keeps at most a few numbers per person,
+# however many days are simulated.
+
+class HangoutCounts:
+    """How many times each person hung out."""
+
+    def __init__(self, nodes=()):
+        self.counts = dict.fromkeys(nodes, 0)
+
+    def add(self, day, groupings):
+        for group in groupings:
+            for n in group:
+                self.counts[n] = self.counts.get(n, 0) + 1
+
+    def result(self):
+        return self.counts
+
+class Fairness(HangoutCounts):
+    """fairness() of the hangout counts of nodes and whoever else hangs out."""
+
+    def result(self):
+        return fairness(list(self.counts.values()))
+
+WAIT_BUCKETS = [1, 2, 3, 4, 5, 6, 7, 8, 10, 12, 14, 21, 30, 60, 90, 180, 365]
+
+class WaitTimes:
+    """Histogram of the days each hangout came after the person's previous
+    one (or the start of the simulation).
+    """
+
+    def __init__(self, buckets=WAIT_BUCKETS):
+        self.last = {}
+        self.histogram = wshom.metrics.Histogram(buckets)
+
+    def add(self, day, groupings):
+        for group in groupings:
+            for n in group:
+                self.histogram.observe(day - self.last.get(n, -1))
+                self.last[n] = day
+
+    def result(self):
+        h = self.histogram
+        return {
+            "mean": h.sum / h.count if h.count else None,
+            "buckets": {("+Inf" if bound == float("inf") else str(bound)): count for (bound, count) in h.cumulative()},
+        }
+
+def fairness(counts):
+    counts = sorted(counts)
+    n = len(counts)
+    total = sum(counts)
+    if not n:
+        return {}
+    # Gini coefficient: 0 when everyone hangs out equally often
+    gini = (2 * sum((i + 1) * c for (i, c) in enumerate(counts)) / (n * total) - (n + 1) / n) if total else 0
+    return {
+        "mean": total / n,
+        "stdev": statistics.pstdev(counts),
+        "min": counts[0],
+        "max": counts[-1],
+        "gini": gini,
+        "never": sum(1 for c in counts if c == 0),
+    }
+
+def read_text_graph():
+    """The friend graph in hub-spoke.txt and complete.txt."""
+    g = nx.Graph()
+    with open("hub-spoke.txt") as f:
+        for l in f:
+            group = [n.strip() for n in l.split(",") if n.strip()]
+            for n in group[1:]:
+                g.add_edge(group[0], n)
+
+    with open("complete.txt") as f:
+        for l in f:
+            group = [n.strip() for n in l.split(" ") if n.strip()]
+            for n1 in group:
+                for n2 in group:
+                    if n1 != n2:
+                        g.add_edge(n1, n2)
+    return g
+
 def main():
-    import time
+    import argparse
     import random
 
+    parser = argparse.ArgumentParser(description="Simulate hangouts on hub-spoke.txt and complete.txt, or a snapshot")
+    parser.add_argument("--steps", type=int, default=100)
+    parser.add_argument("--draw", action="store_true", help="Plot the graph with matplotlib")
+    parser.add_argument("--verbose", action="store_true")
+    parser.add_argument("--snapshot", help="Simulate on this wshom.snapshot instead of the text files")
+    parser.add_argument("--save-snapshot", help="Save the graph read from the text files to this wshom.snapshot")
+    parser.add_argument("--checkpoint", help="Save the simulation's state to this file as it runs")
+    parser.add_argument("--checkpoint-every", type=int, default=100, help="Days between checkpoints")
+    parser.add_argument("--resume", action="store_true", help="Carry on from --checkpoint if it exists")
+    args = parser.parse_args()
+    if args.resume and not args.checkpoint:
+        parser.error("--resume needs --checkpoint")
+
     #nodes = {
     #    "A": {"min_interval": 5},
     #    "B": {"min_interval": 6},
@@ -156,41 +298,43 @@ def main():
     #    ("A", "E"),
     #]
 
-    logging.basicConfig(level=logging.DEBUG)
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
 
     #g = nx.DiGraph()
     #g.add_nodes_from(nodes.items())
     #g.add_edges_from(edges)
 
-    g = nx.Graph()
-    with open("hub-spoke.txt") as f:
-        for l in f:
-            group = [n.strip() for n in l.split(",") if n.strip()]
-            for n in group[1:]:
-                g.add_edge(group[0], n)
-
-    with open("complete.txt") as f:
-        for l in f:
-            group = [n.strip() for n in l.split(" ") if n.strip()]
-            for n1 in group:
-                for n2 in group:
-                    if n1 != n2:
-                        g.add_edge(n1, n2)
+    if args.snapshot:
+        g = wshom.snapshot.load_networkx(args.snapshot)
+    else:
+        g = read_text_graph()
 
     for i in range(1):
         random.seed(i)
         #g = nx.fast_gnp_random_graph(10, 0.5, directed=True)
-        nx.set_node_attributes(g, {n: {"min_interval": random.randint(5, 8)} for n in g.nodes})
-        ug, results = simulate(g)
-        hangouts = {n: 0 for n in ug.nodes}
-        for groupings in results:
-            for group in groupings:
-                for n in group:
-                    hangouts[n] += 1
+        if not args.snapshot:
+            nx.set_node_attributes(g, {n: {"min_interval": random.randint(5, 8)} for n in g.nodes})
+        if args.save_snapshot:
+            wshom.snapshot.save(args.save_snapshot, g)
+        if args.resume and os.path.exists(args.checkpoint):
+            ug, start, aggregators = load_checkpoint(args.checkpoint)
+            print("Resuming on day {}".format(start))
+        else:
+            ug = prepare(g)
+            start = 0
+            aggregators = [HangoutCounts(ug.nodes), WaitTimes(), Fairness(ug.nodes)]
+        for day, groupings in simulate_days(ug, args.steps, aggregators=aggregators, start=start,
+                                            checkpoint=args.checkpoint, checkpoint_every=args.checkpoint_every):
+            print("On day {}, hangouts were".format(day), groupings)
+        if args.draw:
+            import matplotlib.pyplot as plt
+            nx.draw(ug, with_labels=True)
+            plt.show()
 
+        hangouts, wait_times, spread = [aggregator.result() for aggregator in aggregators]
         print("Total hangouts: {}".format(hangouts))
-        for i, hangouts in enumerate(results):
-            print("On day {}, hangouts were".format(i), hangouts)
+        print("Days between hangouts: {}".format(wait_times))
+        print("Fairness: {}".format(spread))
 
 if __name__ == "__main__":
     main()
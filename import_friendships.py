@@ -0,0 +1,13 @@
+import argparse
+import wshom
+
+parser = argparse.ArgumentParser(description="Add friendships from a file of \"username friend [friend ...]\" lines")
+parser.add_argument("path")
+parser.add_argument("--mutual", action="store_true", help="Also add each friendship the other way around")
+args = parser.parse_args()
+
+a = wshom.create_app()
+result = wshom.import_friendships(a, args.path, args.mutual)
+for error in result["errors"]:
+    print("Line {}: {}".format(error["line"], error["error"]))
+print("Added {} friendships, {} already existed, {} errors".format(result["added"], result["existing"], len(result["errors"])))
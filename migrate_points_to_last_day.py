@@ -0,0 +1,4 @@
+import wshom
+
+a = wshom.create_app()
+wshom.migrate_points_to_last_day(a)
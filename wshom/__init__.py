@@ -1,14 +1,19 @@
 import flask
-import flask_sqlalchemy
 import wshom.config
 from wshom.extensions import db, login_manager
-import wshom.config
 import wshom.views
-import wshom.graph
+import wshom.cache
+import wshom.passwords
+
+# Web processes only need the app. The scheduling modules (and networkx,
+# numpy and pytz with them) are imported by the functions below that use
+# them, so they don't slow down starting a web worker.
 
 def register_extensions(app):
     db.init_app(app)
     login_manager.init_app(app)
+    wshom.cache.init_app(app)
+    wshom.passwords.init_app(app)
 
 def register_blueprints(app):
     app.register_blueprint(wshom.views.blueprint)
@@ -25,5 +30,53 @@ def create_db(app):
         db.create_all()
 
 def arrange_hangouts(app):
-    with app.app_context():
+    import wshom.graph
+    import wshom.metrics
+    with app.app_context(), wshom.metrics.instrument(app, "arrange_hangouts"):
         wshom.graph.arrange_hangouts(app)
+
+def arrange_due_shards(app):
+    import wshom.shards
+    import wshom.metrics
+    with app.app_context(), wshom.metrics.instrument(app, "arrange_due_shards"):
+        wshom.shards.arrange_due_shards(app)
+
+def dispatch_notifications(app):
+    import asyncio
+    import wshom.outbox
+    with app.app_context():
+        asyncio.run(wshom.outbox.dispatch(app))
+
+def import_friendships(app, path, mutual=False):
+    """Adds the friendships listed in the file at path (see
+    wshom.friends.parse_friend_lists). Returns wshom.friends.add_friendships's
+    result, with each error's line number added.
+    """
+    import wshom.friends
+    with open(path) as f:
+        rows = list(wshom.friends.parse_friend_lists(f))
+    with app.app_context():
+        result = wshom.friends.add_friendships(app, [(username, friend) for (_, username, friend) in rows], mutual)
+    for error in result["errors"]:
+        error["line"] = rows[error["row"]][0]
+    return result
+
+def export_snapshot(app, path):
+    import wshom.snapshot
+    with app.app_context():
+        wshom.snapshot.export_snapshot(app, path)
+
+def import_snapshot(app, path):
+    import wshom.snapshot
+    with app.app_context():
+        wshom.snapshot.import_snapshot(app, path)
+
+def migrate_points_to_last_day(app):
+    import wshom.graph
+    with app.app_context():
+        wshom.graph.migrate_points_to_last_day(app)
+
+def build_group_index(app):
+    import wshom.groups
+    with app.app_context():
+        wshom.groups.rebuild_group_index(app, app.config["HANGOUT_GROUP_SIZE"])
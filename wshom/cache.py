@@ -0,0 +1,113 @@
+from wshom.model import User
+from wshom.extensions import db
+import collections
+import flask
+import importlib
+import threading
+import time
+import sqlalchemy.orm
+
+# Caching on the request path.
+#
+# Per request (in flask.g), users looked up by username are remembered, so a
+# form validator and the view handling the form share one query.
+#
+# Across requests, user records (for the login manager's user loader) go in a
+# shared cache picked by CACHE_BACKEND: "none", "memory" (an in-process LRU
+# whose entries expire after CACHE_TTL seconds) or module:function for a
+# function taking the app config and returning an object with get, set and
+# delete. Code that changes a user invalidates its
+# entry; other processes with their own memory cache see the change once
+# their entry expires.
+
+class NullCache:
+    def get(self, key):
+        return None
+
+    def set(self, key, value):
+        pass
+
+    def delete(self, key):
+        pass
+
+class MemoryCache:
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+def null_backend(config):
+    return NullCache()
+
+def memory_backend(config):
+    return MemoryCache(config["CACHE_MAXSIZE"], config["CACHE_TTL"])
+
+BACKENDS = {
+    "none": null_backend,
+    "memory": memory_backend,
+}
+
+def init_app(app):
+    name = app.config["CACHE_BACKEND"]
+    if name in BACKENDS:
+        backend = BACKENDS[name]
+    else:
+        module, _, function = name.partition(":")
+        backend = getattr(importlib.import_module(module), function)
+    app.extensions["wshom_cache"] = backend(app.config)
+
+def shared():
+    return flask.current_app.extensions["wshom_cache"]
+
+def user_by_username(username):
+    """The user with username, or None, looked up once per request."""
+    users = flask.g.setdefault("users_by_username", {})
+    if username not in users:
+        users[username] = User.query.filter_by(username=username).first()
+    return users[username]
+
+# Not needed by the user loader, and kept out of shared backends
+_UNCACHED_USER_COLUMNS = {"password_hash"}
+
+def load_user(user_id):
+    """User.query.get(user_id), from the shared cache when possible."""
+    key = "user:{}".format(user_id)
+    values = shared().get(key)
+    if values is None:
+        user = User.query.get(user_id)
+        if user is not None:
+            shared().set(key, {c.name: getattr(user, c.name) for c in User.__table__.columns if c.name not in _UNCACHED_USER_COLUMNS})
+        return user
+
+    # Rebuild a clean instance and attach it without a query. Columns that
+    # weren't cached are loaded if something reads them.
+    user = User(**values)
+    sqlalchemy.orm.make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
+def invalidate_user(user_id):
+    shared().delete("user:{}".format(user_id))
@@ -1,8 +1,40 @@
 import os
-import pkg_resources
-default_db_uri = "sqlite:///" + pkg_resources.resource_filename("wshom", "wshom.db")
+default_db_uri = "sqlite:///" + os.path.join(os.path.dirname(os.path.abspath(__file__)), "wshom.db")
 
 class Config:
     SECRET_KEY = os.environ.get("SECRET_KEY") or "wshom-secret"
     SQLALCHEMY_DATABASE_URI = os.environ.get("DATABASE_URI") or default_db_uri
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    CACHE_BACKEND = os.environ.get("CACHE_BACKEND") or "none" # or "memory", or module:function (see wshom.cache)
+    CACHE_TTL = int(os.environ.get("CACHE_TTL") or 60) # seconds
+    CACHE_MAXSIZE = int(os.environ.get("CACHE_MAXSIZE") or 10000)
+    PASSWORD_HASH_METHOD = os.environ.get("PASSWORD_HASH_METHOD") # None for werkzeug's default; setting it rehashes passwords as users log in
+    PASSWORD_HASH_CHANGE_ALGORITHM = os.environ.get("PASSWORD_HASH_CHANGE_ALGORITHM") == "1" # also rehash hashes made with another algorithm, e.g. scrypt
+    PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS") or 2) # 0 to hash on the request thread
+    PASSWORD_HASH_QUEUE = int(os.environ.get("PASSWORD_HASH_QUEUE") or 16) # hashes that may wait for a worker before logins get a 503
+    PASSWORD_HASH_EXECUTOR = os.environ.get("PASSWORD_HASH_EXECUTOR") or "thread" # or "process"
+    LOGIN_FAILURE_LIMIT = 5 # failed logins per username per window before more are refused; 0 for no limit
+    LOGIN_FAILURE_WINDOW = 300 # seconds
+    FRIENDS_PAGE_SIZE = 50
+    FRIENDS_PAGE_MAX = 500 # largest limit /friends.json accepts
+    FRIENDS_IMPORT_TOKEN = os.environ.get("FRIENDS_IMPORT_TOKEN") # bearer token for /friends/import, which is off without one
+    FRIENDS_IMPORT_MAX = 100000 # most friendships /friends/import takes per request
+    HANGOUT_GROUP_SIZE = 4
+    HANGOUT_WORKERS = int(os.environ.get("HANGOUT_WORKERS") or 1)
+    HANGOUT_GRAPH_CORE = os.environ.get("HANGOUT_GRAPH_CORE") or "networkx" # or "csr"
+    HANGOUT_PRUNE = os.environ.get("HANGOUT_PRUNE") == "1" # drop edges that can never be in a group first
+    HANGOUT_SOLVER = os.environ.get("HANGOUT_SOLVER") or "greedy" # or "exact", "timeboxed"
+    HANGOUT_SOLVER_TIME_LIMIT = float(os.environ.get("HANGOUT_SOLVER_TIME_LIMIT") or 10) # seconds, for "timeboxed"
+    HANGOUT_PLAN_DAYS = int(os.environ.get("HANGOUT_PLAN_DAYS") or 1) # days arranged ahead at once (see wshom.planner)
+    HANGOUT_LOCAL_HOUR = int(os.environ.get("HANGOUT_LOCAL_HOUR") or 18) # when each timezone shard is arranged
+    HANGOUT_DEFAULT_TIMEZONE = os.environ.get("HANGOUT_DEFAULT_TIMEZONE") or "UTC" # for users without one
+    HANGOUT_METRICS = os.environ.get("HANGOUT_METRICS") # "json" or "prometheus" to report metrics for each run
+    HANGOUT_METRICS_PATH = os.environ.get("HANGOUT_METRICS_PATH") # where to write them, instead of the log
+    HANGOUT_PROFILE = os.environ.get("HANGOUT_PROFILE") # "cprofile" or "sampling" to profile each run, into <run>.prof or <run>.folded
+    MAIL_SERVER = os.environ.get("MAIL_SERVER") or "localhost"
+    MAIL_PORT = int(os.environ.get("MAIL_PORT") or 25)
+    MAIL_FROM = os.environ.get("MAIL_FROM") or "wshom@localhost"
+    NOTIFY_BATCH_SIZE = int(os.environ.get("NOTIFY_BATCH_SIZE") or 200)
+    NOTIFY_CONCURRENCY = int(os.environ.get("NOTIFY_CONCURRENCY") or 8) # SMTP connections
+    NOTIFY_MAX_ATTEMPTS = 5
+    NOTIFY_RETRY_DELAY = 60 # seconds before the first retry, doubling after each
@@ -0,0 +1,114 @@
+import collections
+import wshom.search
+
+# Cached 2-edge-connectivity checks for sets of people.
+#
+# Scoring indexed groups checks the same few-person sets over and over, once
+# per seed edge that reaches them. Results are cached by the set of people,
+# least recently used first out. Removing people doesn't change whether the
+# rest are 2-edge-connected, but removing an edge does, so edge_removed drops
+# every cached set containing both of its ends.
+#
+# Small sets are checked on adjacency bitmasks: a set is 2-edge-connected if
+# it is still connected without each of its edges in turn.
+
+BITMASK_LIMIT = 8 # Largest set checked with bitmasks
+DEFAULT_MAXSIZE = 2**16
+
+class ConnectivityCache:
+    def __init__(self, has_edge, maxsize=DEFAULT_MAXSIZE):
+        """has_edge(a, b) says whether a and b are friends in the graph."""
+        self.has_edge = has_edge
+        self.maxsize = maxsize
+        self.entries = collections.OrderedDict()
+        self.by_node = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def is_two_edge_connected(self, nodes):
+        key = frozenset(nodes)
+        result = self.entries.get(key)
+        if result is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return result
+
+        self.misses += 1
+        result = self._check(list(key))
+        if self.maxsize > 0:
+            if len(self.entries) >= self.maxsize:
+                old, _ = self.entries.popitem(last=False)
+                self._unindex(old)
+                self.evictions += 1
+            self.entries[key] = result
+            for n in key:
+                self.by_node.setdefault(n, set()).add(key)
+        return result
+
+    def edge_removed(self, u, v):
+        stale = self.by_node.get(u, set()) & self.by_node.get(v, set())
+        for key in stale:
+            del self.entries[key]
+            self._unindex(key)
+        self.invalidations += len(stale)
+
+    def _unindex(self, key):
+        for n in key:
+            keys = self.by_node[n]
+            keys.discard(key)
+            if not keys:
+                del self.by_node[n]
+
+    def _check(self, nodes):
+        if len(nodes) < 2:
+            return False
+        if len(nodes) > BITMASK_LIMIT:
+            adj = [set(j for j in range(len(nodes)) if j != i and self.has_edge(a, nodes[j])) for (i, a) in enumerate(nodes)]
+            return wshom.search._is_two_edge_connected(range(len(nodes)), adj)
+
+        masks = [0] * len(nodes)
+        edges = []
+        for i, a in enumerate(nodes):
+            for j in range(i + 1, len(nodes)):
+                if self.has_edge(a, nodes[j]):
+                    masks[i] |= 1 << j
+                    masks[j] |= 1 << i
+                    edges.append((i, j))
+        if any(bin(mask).count("1") < 2 for mask in masks):
+            return False
+        full = (1 << len(nodes)) - 1
+        if not _connected(masks, full):
+            return False
+        for i, j in edges:
+            masks[i] ^= 1 << j
+            masks[j] ^= 1 << i
+            connected = _connected(masks, full)
+            masks[i] ^= 1 << j
+            masks[j] ^= 1 << i
+            if not connected:
+                return False
+        return True
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "size": len(self.entries),
+        }
+
+def _connected(masks, full):
+    reached = 1
+    frontier = 1
+    while frontier:
+        i = frontier.bit_length() - 1
+        frontier ^= 1 << i
+        new = masks[i] & ~reached
+        reached |= new
+        frontier |= new
+    return reached == full
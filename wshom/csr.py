@@ -0,0 +1,295 @@
+import networkx as nx
+import numpy as np
+import logging
+import wshom.search
+import wshom.groups
+import wshom.pruning
+import wshom.connectivity
+import wshom.metrics
+
+# Array-backed friend graph for the scheduling algorithms.
+#
+# Users are numbered 0..n-1 and edges 0..m-1. Node and edge attributes live in
+# flat NumPy arrays, and adjacency is stored CSR-style: the neighbors of node
+# i are indices[indptr[i]:indptr[i + 1]], and slot_edge gives the edge number
+# of each of those entries.
+#
+# Each node lists the neighbors that come before it in node order first (in
+# node order), then the ones after it (in edge order). That is the order
+# Graph.copy() gives them, which is what get_groupings sees, so searches on a
+# CSRGraph break ties exactly like searches on the networkx graph.
+#
+# Subgraphs such as the eligible users are views: they share every array and
+# only carry their own node and edge masks.
+
+logger = logging.getLogger(__name__)
+
+NO_ROW = -1 # saved_last_day of a node or edge without a database row
+
+class CSRGraph:
+    def __init__(self, labels, min_interval, points, saved_last_day,
+                 edge_u, edge_v, edge_points, edge_saved_last_day, graph=None, adjacency=None):
+        self.labels = list(labels)
+        self.index = {n: i for (i, n) in enumerate(self.labels)}
+        self.min_interval = np.asarray(min_interval, dtype=np.int64)
+        self.points = np.asarray(points, dtype=np.int64)
+        self.saved_last_day = np.asarray(saved_last_day, dtype=np.int64)
+        self.edge_u = np.asarray(edge_u, dtype=np.int64)
+        self.edge_v = np.asarray(edge_v, dtype=np.int64)
+        self.edge_points = np.asarray(edge_points, dtype=np.int64)
+        self.edge_saved_last_day = np.asarray(edge_saved_last_day, dtype=np.int64)
+        self.graph = dict(graph or {})
+        self.node_mask = np.ones(len(self.labels), dtype=bool)
+        self.edge_kept = np.ones(len(self.edge_u), dtype=bool)
+        if adjacency is None:
+            self._build_adjacency()
+        else:
+            # (indptr, indices, slot_edge) as _build_adjacency would make
+            # them, e.g. from a wshom.snapshot
+            self.indptr, self.indices, self.slot_edge = [np.asarray(a, dtype=np.int64) for a in adjacency]
+
+    def _build_adjacency(self):
+        n = len(self.labels)
+        m = len(self.edge_u)
+        first = np.minimum(self.edge_u, self.edge_v)
+        second = np.maximum(self.edge_u, self.edge_v)
+        edge_ids = np.arange(m, dtype=np.int64)
+
+        # Every edge takes a slot at each end. Sort the slots by node, then
+        # earlier neighbors (by neighbor) before later ones (by edge).
+        node = np.concatenate([second, first])
+        neighbor = np.concatenate([first, second])
+        slot_edge = np.concatenate([edge_ids, edge_ids])
+        later = np.concatenate([np.zeros(m, dtype=bool), np.ones(m, dtype=bool)])
+        order = np.lexsort((np.where(later, slot_edge, neighbor), later, node))
+
+        self.indices = neighbor[order]
+        self.slot_edge = slot_edge[order]
+        self.indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(node, minlength=n), out=self.indptr[1:])
+
+    def view(self, node_mask=None, edge_mask=None):
+        """A subgraph sharing this graph's arrays, restricted to node_mask and
+        edge_mask.
+        """
+        g = object.__new__(CSRGraph)
+        g.__dict__.update(self.__dict__)
+        if node_mask is not None:
+            g.node_mask = self.node_mask & node_mask
+        if edge_mask is not None:
+            g.edge_kept = self.edge_kept & edge_mask
+        return g
+
+    def edge_mask(self):
+        return self.node_mask[self.edge_u] & self.node_mask[self.edge_v] & self.edge_kept
+
+    def __len__(self):
+        return int(self.node_mask.sum())
+
+def from_networkx(g):
+    labels = list(g.nodes)
+    index = {n: i for (i, n) in enumerate(labels)}
+
+    def saved(d):
+        return d.get("saved_last_day") if d.get("saved_last_day") is not None else NO_ROW
+
+    nodes = [g.nodes[n] for n in labels]
+    edges = list(g.edges(data=True))
+    return CSRGraph(
+        labels,
+        [d.get("min_interval", 0) for d in nodes],
+        [d.get("points", 0) for d in nodes],
+        [saved(d) for d in nodes],
+        [index[u] for (u, v, d) in edges],
+        [index[v] for (u, v, d) in edges],
+        [d.get("points", 0) for (u, v, d) in edges],
+        [saved(d) for (u, v, d) in edges],
+        graph=g.graph)
+
+def from_rows(nodes, edges, graph=None):
+    """Builds a CSRGraph from (id, min_interval, points, saved_last_day) node rows
+    and (u, v, points, saved_last_day) edge rows, in that order.
+
+    u must come before v in node order.
+    """
+    labels, min_interval, points, saved_last_day = [], [], [], []
+    for n, n_min_interval, n_points, n_saved in nodes:
+        labels.append(n)
+        min_interval.append(n_min_interval)
+        points.append(n_points)
+        saved_last_day.append(n_saved if n_saved is not None else NO_ROW)
+    index = {n: i for (i, n) in enumerate(labels)}
+
+    edge_u, edge_v, edge_points, edge_saved_last_day = [], [], [], []
+    for u, v, e_points, e_saved in edges:
+        edge_u.append(index[u])
+        edge_v.append(index[v])
+        edge_points.append(e_points)
+        edge_saved_last_day.append(e_saved if e_saved is not None else NO_ROW)
+
+    return CSRGraph(labels, min_interval, points, saved_last_day,
+                    edge_u, edge_v, edge_points, edge_saved_last_day, graph=graph)
+
+def to_networkx(cg):
+    g = nx.Graph(**cg.graph)
+
+    def saved(x):
+        return int(x) if x != NO_ROW else None
+
+    for i in np.flatnonzero(cg.node_mask):
+        g.add_node(cg.labels[i], min_interval=int(cg.min_interval[i]), points=int(cg.points[i]), saved_last_day=saved(cg.saved_last_day[i]))
+    for k in np.flatnonzero(cg.edge_mask()):
+        g.add_edge(cg.labels[cg.edge_u[k]], cg.labels[cg.edge_v[k]], points=int(cg.edge_points[k]), saved_last_day=saved(cg.edge_saved_last_day[k]))
+    return g
+
+def zero_points(cg, nodes=None):
+    if nodes is None:
+        members = np.ones(len(cg.labels), dtype=bool)
+    else:
+        members = np.zeros(len(cg.labels), dtype=bool)
+        members[[cg.index[n] for n in nodes]] = True
+    cg.points[members] = 0
+    cg.edge_points[members[cg.edge_u] & members[cg.edge_v]] = 0
+
+def increment_points(cg):
+    cg.points += 1
+    cg.edge_points += 1
+
+def without_ineligible(cg):
+    return cg.view(cg.points >= cg.min_interval)
+
+def without_unusable(cg, size):
+    """A view of cg without the edges wshom.pruning.unusable_edges finds."""
+    alive = np.flatnonzero(cg.edge_mask()).tolist()
+    edges = list(zip(cg.edge_u[alive].tolist(), cg.edge_v[alive].tolist()))
+    edge_ids = dict(zip(edges, alive))
+    keep = np.ones(len(cg.edge_u), dtype=bool)
+    keep[[edge_ids[e] for e in wshom.pruning.unusable_edges(edges, size)]] = False
+    return cg.view(edge_mask=keep)
+
+class _Search:
+    """Group search over a CSRGraph whose nodes and edges are being removed."""
+
+    def __init__(self, cg):
+        self.cg = cg
+        self.indptr = cg.indptr.tolist()
+        self.indices = cg.indices.tolist()
+        self.slot_edge = cg.slot_edge.tolist()
+        self.edge_points = cg.edge_points.tolist()
+        self.node_alive = cg.node_mask.tolist()
+        self.edge_alive = cg.edge_mask().tolist()
+        self.n_alive = sum(self.node_alive)
+        self.connectivity = wshom.connectivity.ConnectivityCache(self.has_edge)
+
+    def neighbors(self, i):
+        for slot in range(self.indptr[i], self.indptr[i + 1]):
+            j = self.indices[slot]
+            e = self.slot_edge[slot]
+            if self.node_alive[j] and self.edge_alive[e]:
+                yield j, self.edge_points[e]
+
+    def has_edge(self, i, j):
+        if self.indptr[i + 1] - self.indptr[i] > self.indptr[j + 1] - self.indptr[j]:
+            i, j = j, i
+        for slot in range(self.indptr[i], self.indptr[i + 1]):
+            if self.indices[slot] == j:
+                return self.node_alive[i] and self.node_alive[j] and self.edge_alive[self.slot_edge[slot]]
+        return False
+
+    def _bfs(self, source, cutoff):
+        # Same visiting order as nx.single_source_shortest_path_length
+        seen = {source}
+        order = [source]
+        nextlevel = [source]
+        level = 0
+        while nextlevel and cutoff > level:
+            level += 1
+            thislevel = nextlevel
+            nextlevel = []
+            for v in thislevel:
+                for w, _ in self.neighbors(v):
+                    if w not in seen:
+                        seen.add(w)
+                        nextlevel.append(w)
+                        order.append(w)
+                if len(seen) == self.n_alive:
+                    return order
+        return order
+
+    def candidate_nodes(self, edge, size):
+        # Built from user labels exactly as wshom.search.candidate_nodes builds
+        # it, so the candidates come out in the same order.
+        labels = self.cg.labels
+        max_depth = size - 1
+        (n1, n2) = [dict.fromkeys(labels[i] for i in self._bfs(n, max_depth - 1)) for n in edge]
+        nodes = set(n1).union(n2)
+        nodes -= set(labels[i] for i in edge)
+        return [self.cg.index[n] for n in nodes]
+
+    def best_group(self, edge, size):
+        local = list(edge) + self.candidate_nodes(edge, size)
+        adj = wshom.search._local_adjacency(local, self.neighbors)
+        group, score = wshom.search._search_local(local, adj, size, find_best=True)
+        if group is None:
+            return None, None
+        return set(self.cg.labels[i] for i in group), score
+
+    def best_indexed_group(self, edge, groups_by_edge):
+        labels = self.cg.labels
+        best_group, best_score = None, None
+        for group in groups_by_edge.get(tuple(sorted((labels[edge[0]], labels[edge[1]]))), []):
+            members = [self.cg.index.get(n) for n in group]
+            if any(i is None or not self.node_alive[i] for i in members):
+                continue
+            if not self.connectivity.is_two_edge_connected(members):
+                continue
+            adj = wshom.search._local_adjacency(members, self.neighbors)
+            score = sum(w for a in adj for w in a.values()) // 2
+            if best_score is None or score > best_score:
+                best_group, best_score = group, score
+        return best_group, best_score
+
+    def remove_edge(self, e, u, v):
+        self.edge_alive[e] = False
+        self.connectivity.edge_removed(u, v)
+
+    def remove_nodes(self, nodes):
+        for i in nodes:
+            self.node_alive[i] = False
+        self.n_alive -= len(nodes)
+
+def get_groupings(cg, size=4, groups=None):
+    """wshom.graph.get_groupings on a CSRGraph (or a view of one).
+
+    Returns the same groupings, as sets of user labels.
+    """
+    search = _Search(cg)
+    if groups is not None:
+        groups_by_edge = wshom.groups.index_by_edge(groups)
+
+    # Highest points first, ties in edge order
+    alive = np.flatnonzero(cg.edge_mask())
+    order = alive[np.argsort(-cg.edge_points[alive], kind="stable")].tolist()
+    edge_u = cg.edge_u.tolist()
+    edge_v = cg.edge_v.tolist()
+
+    groupings = []
+    for e in order:
+        u, v = edge_u[e], edge_v[e]
+        if not (search.edge_alive[e] and search.node_alive[u] and search.node_alive[v]):
+            continue
+        if groups is not None:
+            group, _ = search.best_indexed_group((u, v), groups_by_edge)
+        else:
+            group, _ = search.best_group((u, v), size)
+        if group:
+            groupings.append(group)
+            search.remove_nodes([cg.index[n] for n in group])
+        else:
+            search.remove_edge(e, u, v)
+    logger.debug("Was able to put {} / {} eligible people into groups".format(len(cg) - search.n_alive, len(cg)))
+    if groups is not None:
+        logger.debug("Connectivity cache: {}".format(search.connectivity.stats()))
+        wshom.metrics.count("connectivity_checks", search.connectivity.misses)
+        wshom.metrics.count("connectivity_cache_hits", search.connectivity.hits)
+    return groupings
@@ -3,10 +3,22 @@ import wtforms
 import wtforms.fields.html5
 import wtforms.validators
 from wshom.model import User
+import wshom.cache
+import wshom.friends
 from flask_login import current_user
-import pytz
+import functools
 import string
 
+@functools.lru_cache()
+def timezone_choices():
+    """Choices for ProfileForm.timezone, built the first time they're needed."""
+    import pytz
+    return [("", "unspecified")] + [(tzname, tzname.replace("_", " ")) for tzname in pytz.common_timezones]
+
+@functools.lru_cache()
+def _timezone_names():
+    return frozenset(val for (val, _) in timezone_choices())
+
 class LoginForm(flask_wtf.FlaskForm):
     username = wtforms.StringField("Username", validators=[wtforms.validators.DataRequired()])
     password = wtforms.PasswordField("Password", validators=[wtforms.validators.DataRequired()])
@@ -29,7 +41,7 @@ class RegisterForm(flask_wtf.FlaskForm):
         if any(c not in allowed_characters for c in self.username.data):
             raise wtforms.ValidationError("Username may only contain lowercase letters, digits, and undescores.")
 
-        if User.query.filter_by(username=self.username.data).first():
+        if wshom.cache.user_by_username(self.username.data):
             raise wtforms.ValidationError("Username already taken")
 
 class AddFriendForm(flask_wtf.FlaskForm):
@@ -37,12 +49,12 @@ class AddFriendForm(flask_wtf.FlaskForm):
     submit_add = wtforms.SubmitField("Add Friend")
 
     def validate_add_username(self, field):
-        user = User.query.filter_by(username=self.add_username.data).first()
+        user = wshom.cache.user_by_username(self.add_username.data)
         if user is None:
             raise wtforms.ValidationError("User not found")
         if user == current_user:
             raise wtforms.ValidationError("That's you")
-        if user in current_user.friends:
+        if wshom.friends.has_friend(current_user.id, user.id):
             raise wtforms.ValidationError("User is already a friend")
 
 class DeleteFriendForm(flask_wtf.FlaskForm):
@@ -50,24 +62,30 @@ class DeleteFriendForm(flask_wtf.FlaskForm):
     submit_delete = wtforms.SubmitField("[X]")
 
     def validate_delete_username(self, field):
-        user = User.query.filter_by(username=self.delete_username.data).first()
+        user = wshom.cache.user_by_username(self.delete_username.data)
         if user is None:
             raise wtforms.ValidationError("User not found")
         if user == current_user:
             raise wtforms.ValidationError("That's you")
-        if user not in current_user.friends:
+        if not wshom.friends.has_friend(current_user.id, user.id):
             raise wtforms.ValidationError("User is not a friend")
 
 class ProfileForm(flask_wtf.FlaskForm):
-    tz_choices = [("", "unspecified")] + [(tzname, tzname.replace("_", " ")) for tzname in pytz.common_timezones]
-
     email = wtforms.StringField("Email", validators=[wtforms.validators.Email()])
     display_name = wtforms.StringField("Display Name", validators=[wtforms.validators.Length(max=240)])
-    timezone = wtforms.SelectField("Timezone", choices=tz_choices, validators=[wtforms.validators.AnyOf(set(val for (val, _) in tz_choices), "Not a valid timezone")])
+    timezone = wtforms.SelectField("Timezone")
     min_interval = wtforms.fields.html5.IntegerField("Minimum interval between hangouts (days)", validators=[wtforms.validators.NumberRange(3, 12, "Value must be between %(min)s and %(max)s")])
     active = wtforms.BooleanField("Active")
     submit = wtforms.SubmitField("Update")
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.timezone.choices = timezone_choices()
+
+    def validate_timezone(self, field):
+        if field.data not in _timezone_names():
+            raise wtforms.ValidationError("Not a valid timezone")
+
     def validate_email(self, field):
         if User.query.filter_by(email=self.email.data).first():
             raise wtforms.ValidationError("Email already in use")
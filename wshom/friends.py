@@ -0,0 +1,116 @@
+from wshom.model import User, friendship
+from wshom.extensions import db
+
+# Friend lookups that cost the same however many friends a user has. Both go
+# through the friendships primary key (user_id, friend_id): membership is a
+# single key lookup, and lists are paged by friend id, so each page is a
+# range scan of the key starting after the previous page.
+#
+# add_friendships is the bulk counterpart of the /friends form, for
+# onboarding whole communities: usernames are resolved and existing
+# friendships found with a query per IMPORT_BATCH_SIZE users, and new rows are
+# inserted IMPORT_BATCH_SIZE at a time.
+
+IMPORT_BATCH_SIZE = 1000
+
+def has_friend(user_id, friend_id):
+    """Whether user_id has added friend_id as a friend."""
+    q = db.session.query(friendship.c.user_id).filter(friendship.c.user_id == user_id, friendship.c.friend_id == friend_id)
+    return db.session.query(q.exists()).scalar()
+
+def friends_page(user_id, after=None, limit=50):
+    """Returns ([(id, username, display_name)], next) for the friends of
+    user_id with ids after after, in id order.
+
+    next is the after for the following page, or None if this is the last.
+    """
+    q = (db.session.query(User.id, User.username, User.display_name)
+        .join(friendship, friendship.c.friend_id == User.id)
+        .filter(friendship.c.user_id == user_id))
+    if after is not None:
+        q = q.filter(friendship.c.friend_id > after)
+    rows = q.order_by(friendship.c.friend_id).limit(limit + 1).all()
+    if len(rows) > limit:
+        return rows[:limit], rows[limit - 1].id
+    return rows, None
+
+def _batches(items, size=IMPORT_BATCH_SIZE):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def parse_friend_lists(lines):
+    """Yields (line number, username, friend username) for lines of
+    "username friend [friend ...]", separated by spaces or commas. Blank lines
+    and lines starting with # are skipped.
+    """
+    for line_number, line in enumerate(lines, 1):
+        names = line.replace(",", " ").split()
+        if not names or names[0].startswith("#"):
+            continue
+        if len(names) == 1:
+            yield line_number, names[0], None
+        for friend in names[1:]:
+            yield line_number, names[0], friend
+
+def is_pair(pair):
+    """Whether pair is a list or tuple of a username and a friend's username.
+    Other iterables of two items (e.g. the string "de") aren't.
+    """
+    return isinstance(pair, (list, tuple)) and len(pair) == 2 and all(isinstance(name, str) for name in pair)
+
+def add_friendships(app, pairs, mutual=False):
+    """Adds a friendship for each (username, friend username) in pairs, and
+    the other way around too if mutual, then commits.
+
+    Returns {"added": friendships added, "existing": friendships that were
+    already there, "errors": [{"row": index into pairs, "error": message}]}.
+    """
+    errors = []
+    rows = []
+    for i, pair in enumerate(pairs):
+        if not is_pair(pair):
+            errors.append({"row": i, "error": "Expected a username and a friend's username"})
+            continue
+        username, friend = pair
+        if username == friend:
+            errors.append({"row": i, "error": "A user can't be their own friend"})
+        else:
+            rows.append((i, username, friend))
+
+    user_ids = {}
+    for batch in _batches(set(name for (_, username, friend) in rows for name in (username, friend))):
+        user_ids.update((name, n) for (n, name) in db.session.query(User.id, User.username).filter(User.username.in_(batch)))
+
+    wanted = {}
+    for i, username, friend in rows:
+        missing = [name for name in (username, friend) if name not in user_ids]
+        if missing:
+            errors.append({"row": i, "error": "User not found: {}".format(", ".join(missing))})
+            continue
+        u, v = user_ids[username], user_ids[friend]
+        wanted.setdefault((u, v), i)
+        if mutual:
+            wanted.setdefault((v, u), i)
+
+    # Existing friendships both ways, to skip them and to tell which new ones
+    # complete a mutual friendship
+    existing = set()
+    for batch in _batches(set(n for pair in wanted for n in pair)):
+        existing.update((u, v) for (u, v) in db.session.query(friendship.c.user_id, friendship.c.friend_id).filter(friendship.c.user_id.in_(batch)))
+    new = [pair for pair in wanted if pair not in existing]
+    for batch in _batches(new):
+        db.session.execute(friendship.insert(), [{"user_id": u, "friend_id": v} for (u, v) in batch])
+
+    # Scheduler state, in one pass for every friendship that became mutual
+    existing.update(new)
+    edges = set((min(u, v), max(u, v)) for (u, v) in new if (v, u) in existing)
+    if edges:
+        import wshom.groups
+        import wshom.planner
+        wshom.groups.friendships_added(sorted(edges), app.config["HANGOUT_GROUP_SIZE"])
+        wshom.planner.invalidate(app, [n for edge in edges for n in edge])
+    db.session.commit()
+
+    errors.sort(key=lambda e: e["row"])
+    return {"added": len(new), "existing": len(wanted) - len(new), "errors": errors}
@@ -1,54 +1,134 @@
-from wshom.model import User, GraphNode, GraphEdge
+from wshom.model import User, GraphNode, GraphEdge, friendship
 from wshom.extensions import db
+import sqlalchemy
+import concurrent.futures
+import datetime
 import networkx as nx
+import numpy as np
+import heapq
+import logging
+import wshom.search
+import wshom.groups
+import wshom.csr
+import wshom.packing
+import wshom.pruning
+import wshom.connectivity
+import wshom.metrics
+import wshom.outbox
+import wshom.upserts
 
-def to_undirected(g):
-    g = g.copy()
-    single_edges = [(u,v) for (u, v) in g.edges if not g.has_edge(v, u)]
-    g.remove_edges_from(single_edges)
-    g = g.to_undirected()
-    return g
+logger = logging.getLogger(__name__)
+
+def today():
+    return datetime.date.today().toordinal()
 
-def graph_from_database(app):
-    g = nx.DiGraph()
-    for user, graph_node in db.session.query(User, GraphNode).outerjoin(GraphNode).filter(User.active == True):
-        g.add_node(user.id, min_interval=user.min_interval, points=(graph_node.points if graph_node is not None else 0))
+def _node_rows(day, timezones=None):
+    """Yields (user id, min_interval, points, saved last_day) for active users."""
+    users = (db.session.query(User.id, User.min_interval, GraphNode.last_day)
+        .outerjoin(GraphNode)
+        .filter(User.active == True))
+    if timezones is not None:
+        users = users.filter(User.timezone.in_(timezones))
+    users = users.order_by(User.id)
+    for user_id, min_interval, last_day in users.yield_per(1000):
+        yield user_id, min_interval, day - (last_day if last_day is not None else day - 1), last_day
 
-        for friend in user.friends:
-            g.add_edge(user.id, friend.id, points=0)
+def _edge_rows(day, timezones=None):
+    """Yields (lower id, higher id, points, saved last_day) for mutual friendships."""
+    # A friendship is an edge if it goes both ways and both users are active.
+    # Its last day is saved as (lower id, higher id). migrate_points_to_last_day
+    # turns around older rows saved the other way.
+    f1 = friendship.alias()
+    f2 = friendship.alias()
+    ua = User.__table__.alias()
+    ub = User.__table__.alias()
+    ge = GraphEdge.__table__
+    edges = (db.session.query(f1.c.user_id, f1.c.friend_id, ge.c.last_day)
+        .select_from(f1)
+        .join(f2, db.and_(f2.c.user_id == f1.c.friend_id, f2.c.friend_id == f1.c.user_id))
+        .join(ua, ua.c.id == f1.c.user_id)
+        .join(ub, ub.c.id == f1.c.friend_id)
+        .outerjoin(ge, db.and_(ge.c.user_a_id == f1.c.user_id, ge.c.user_b_id == f1.c.friend_id))
+        .filter(f1.c.user_id < f1.c.friend_id, ua.c.active == True, ub.c.active == True))
+    if timezones is not None:
+        edges = edges.filter(ua.c.timezone.in_(timezones), ub.c.timezone.in_(timezones))
+    edges = edges.order_by(f1.c.user_id, f1.c.friend_id)
+    for u, v, last_day in edges.yield_per(1000):
+        yield u, v, day - (last_day if last_day is not None else day - 1), last_day
 
-    g = to_undirected(g)
+def graph_from_database(app, day=None, timezones=None):
+    """Loads active users and their mutual friendships in two queries.
 
-    for graph_edge in GraphEdge.query:
-        edge_pair = (graph_edge.user_a_id, graph_edge.user_b_id)
-        if edge_pair in g.edges:
-            g.add_edge(*edge_pair, points=graph_edge.points)
+    Points are the number of days from each node's or edge's last hangout to
+    day (today by default). Nodes and edges without a row yet get 1 point, as
+    though they had been added the day before.
 
+    If timezones is given, only users in those timezones and the friendships
+    between them are loaded.
+    """
+    if day is None:
+        day = today()
+    g = nx.Graph(day=day)
+    for user_id, min_interval, points, saved_last_day in _node_rows(day, timezones):
+        g.add_node(user_id, min_interval=min_interval, points=points, saved_last_day=saved_last_day)
+    for u, v, points, saved_last_day in _edge_rows(day, timezones):
+        g.add_edge(u, v, points=points, saved_last_day=saved_last_day)
     return g
 
+def csr_graph_from_database(app, day=None, timezones=None):
+    """graph_from_database, loaded straight into a wshom.csr.CSRGraph."""
+    if day is None:
+        day = today()
+    return wshom.csr.from_rows(_node_rows(day, timezones), _edge_rows(day, timezones), graph={"day": day})
+
 def save_graph_to_database(app, g):
-    g = g.copy()
+    """Writes back the last days that changed since graph_from_database.
 
-    for graph_edge in GraphEdge.query.with_for_update():
-        uv = graph_edge.user_a_id, graph_edge.user_b_id
-        if g.has_edge(*uv):
-            graph_edge.points = g.edge[uv]["points"]
-            g.remove_edge(*uv)
+    Usually that is only the nodes and edges of the day's groups, plus any
+    that did not have a row yet.
+    """
+    day = g.graph["day"]
 
-    for u, v in g.edges:
-        points = g.edges[u, v]["points"]
-        db.session.add(GraphEdge(user_a_id=u, user_b_id=v, points=points))
+    node_updates, node_inserts = [], []
+    for n, data in g.nodes(data=True):
+        last_day = day - data["points"]
+        if last_day != data.get("saved_last_day"):
+            row = {"user_id": n, "last_day": last_day}
+            (node_inserts if data.get("saved_last_day") is None else node_updates).append(row)
 
-    for graph_node in GraphNode.query.with_for_update():
-        node_id = graph_edge.user_id
-        if g.has_node(node_id):
-            graph_node.points = g.nodes[node_id]["points"]
-            g.remove_node(*uv)
+    edge_updates, edge_inserts = [], []
+    for u, v, data in g.edges(data=True):
+        last_day = day - data["points"]
+        if last_day != data.get("saved_last_day"):
+            row = {"user_a_id": min(u, v), "user_b_id": max(u, v), "last_day": last_day}
+            (edge_inserts if data.get("saved_last_day") is None else edge_updates).append(row)
 
-    for n in g.nodes:
-        points = g.nodes[n]["points"]
-        db.session.add(GraphNode(user_id=n, points=points))
+    wshom.upserts.upsert_last_day(GraphNode.__table__, ["user_id"], node_updates, node_inserts)
+    wshom.upserts.upsert_last_day(GraphEdge.__table__, ["user_a_id", "user_b_id"], edge_updates, edge_inserts)
+    db.session.commit()
 
+def save_csr_graph_to_database(app, cg):
+    """save_graph_to_database for a wshom.csr.CSRGraph."""
+    day = cg.graph["day"]
+    labels = cg.labels
+
+    last_day = day - cg.points
+    changed = last_day != cg.saved_last_day
+    new = cg.saved_last_day == wshom.csr.NO_ROW
+    node_updates = [{"user_id": labels[i], "last_day": int(last_day[i])} for i in np.flatnonzero(changed & ~new)]
+    node_inserts = [{"user_id": labels[i], "last_day": int(last_day[i])} for i in np.flatnonzero(changed & new)]
+
+    last_day = day - cg.edge_points
+    changed = last_day != cg.edge_saved_last_day
+    new = cg.edge_saved_last_day == wshom.csr.NO_ROW
+    def edge_row(k):
+        u, v = labels[cg.edge_u[k]], labels[cg.edge_v[k]]
+        return {"user_a_id": min(u, v), "user_b_id": max(u, v), "last_day": int(last_day[k])}
+    edge_updates = [edge_row(k) for k in np.flatnonzero(changed & ~new)]
+    edge_inserts = [edge_row(k) for k in np.flatnonzero(changed & new)]
+
+    wshom.upserts.upsert_last_day(GraphNode.__table__, ["user_id"], node_updates, node_inserts)
+    wshom.upserts.upsert_last_day(GraphEdge.__table__, ["user_a_id", "user_b_id"], edge_updates, edge_inserts)
     db.session.commit()
 
 def zero_points(g, nodes=None):
@@ -67,68 +147,260 @@ def without_ineligible(g):
     g.remove_nodes_from(ineligible_nodes)
     return g
 
-def arrange_hangouts(app):
-    g = graph_from_database(app)
-    increment_points(g)
-    eg = without_ineligible(g)
-    if eg.nodes:
-        groupings = get_groupings(eg)
-        for group in groupings:
+def without_unusable(g, size):
+    """A copy of g without the edges that can never be in a group."""
+    g = g.copy()
+    g.remove_edges_from(wshom.pruning.unusable_edges(list(g.edges), size))
+    return g
+
+def arrange_hangouts(app, day=None, solver=None, timezones=None):
+    """solver is "greedy", "exact" or "timeboxed"; HANGOUT_SOLVER by default.
+
+    If timezones is given, only users in those timezones are scheduled (see
+    wshom.shards).
+    """
+    # Points already count the days up to today, so there is no
+    # increment_points step.
+    if app.config["HANGOUT_PLAN_DAYS"] > 1 and timezones is None:
+        import wshom.planner as planner
+        return planner.arrange_planned_hangouts(app, day, solver)
+    if app.config["HANGOUT_GRAPH_CORE"] == "csr":
+        return arrange_hangouts_csr(app, day, solver, timezones)
+
+    with wshom.metrics.phase("load"):
+        g = graph_from_database(app, day, timezones)
+    groupings = choose_groupings(app, g, solver)
+    save_groupings(app, g, groupings)
+
+def choose_groupings(app, g, solver=None, groups=None):
+    """The day's groups for g, as loaded by graph_from_database.
+
+    groups is the group index; it is loaded if it's needed and not given.
+    Groups are searched for if it hasn't been built.
+    """
+    size = app.config["HANGOUT_GROUP_SIZE"]
+    workers = app.config["HANGOUT_WORKERS"]
+    with wshom.metrics.phase("filter"):
+        eg = without_ineligible(g)
+    if app.config["HANGOUT_PRUNE"]:
+        with wshom.metrics.phase("prune"):
+            eg = without_unusable(eg, size)
+    if not eg.nodes:
+        return []
+
+    if groups is None:
+        with wshom.metrics.phase("load_index"):
+            groups = wshom.groups.load_group_index(size)
+    with wshom.metrics.phase("grouping"):
+        if workers > 1:
+            groupings = get_groupings_parallel(eg, size, groups=groups, workers=workers)
+        else:
+            groupings = get_groupings(eg, size, groups=groups)
+    with wshom.metrics.phase("solve"):
+        groupings = improve_groupings(app, eg, size, groups, groupings, solver)
+    _count_groupings(len(eg.nodes), groupings, lambda n: g.nodes[n]["points"])
+    return groupings
+
+def save_groupings(app, g, groupings):
+    """Zeroes the points of groupings in g, queues their notifications and
+    saves g, all in one commit.
+    """
+    debug = logger.isEnabledFor(logging.DEBUG)
+    for group in groupings:
+        if debug:
             logger.debug(", ".join([repr(n) for n in group]) + " should hang out")
-            zero_points(ug, group)
+        zero_points(g, group)
+
+    with wshom.metrics.phase("save"):
+        wshom.outbox.enqueue_hangouts(g.graph["day"], groupings)
+        save_graph_to_database(app, g)
+
+def arrange_hangouts_csr(app, day=None, solver=None, timezones=None):
+    """arrange_hangouts on the array-backed graph in wshom.csr."""
+    debug = logger.isEnabledFor(logging.DEBUG)
+    with wshom.metrics.phase("load"):
+        g = csr_graph_from_database(app, day, timezones)
+    size = app.config["HANGOUT_GROUP_SIZE"]
+    with wshom.metrics.phase("filter"):
+        eg = wshom.csr.without_ineligible(g)
+    if app.config["HANGOUT_PRUNE"]:
+        with wshom.metrics.phase("prune"):
+            eg = wshom.csr.without_unusable(eg, size)
+    if len(eg):
+        with wshom.metrics.phase("load_index"):
+            groups = wshom.groups.load_group_index(size)
+        with wshom.metrics.phase("grouping"):
+            groupings = wshom.csr.get_groupings(eg, size, groups=groups)
+        if (solver or app.config["HANGOUT_SOLVER"]) != "greedy":
+            with wshom.metrics.phase("solve"):
+                groupings = improve_groupings(app, wshom.csr.to_networkx(eg), size, groups, groupings, solver)
+        _count_groupings(len(eg), groupings, lambda n: int(g.points[g.index[n]]))
+        for group in groupings:
+            if debug:
+                logger.debug(", ".join([repr(n) for n in group]) + " should hang out")
+            wshom.csr.zero_points(g, group)
     else:
         groupings = []
 
-    # TODO Do something with groupings
+    # Queued in the same commit as the points
+    with wshom.metrics.phase("save"):
+        wshom.outbox.enqueue_hangouts(g.graph["day"], groupings)
+        save_csr_graph_to_database(app, g)
 
-    save_graph_to_database(app, g)
+def _count_groupings(eligible, groupings, points):
+    if wshom.metrics.active is None:
+        return
+    grouped = sum(len(group) for group in groupings)
+    wshom.metrics.count("people_eligible", eligible)
+    wshom.metrics.count("groups_formed", len(groupings))
+    wshom.metrics.count("people_left_out", eligible - grouped)
+    for group in groupings:
+        for n in group:
+            wshom.metrics.observe("days_since_last_hangout", points(n))
 
-def get_best_group(g, edge, size, return_exists=False):
-    logger.debug("Get best group for {}".format(repr(edge)))
-    max_depth = size - 1
-    (n1, n2) = [nx.bfs_tree(g, n, depth_limit=max_depth - 1).nodes for n in edge]
-    nodes = set(n1).union(n2)
-    nodes -= set(edge)
-    combos = (set(edge) | set(c) for c in itertools.combinations(nodes, size - 2))
-    combo_graphs = (g.subgraph(c) for c in combos)
-
-    def score(gg):
-        if not nx.is_k_edge_connected(gg, 2):
-            return None
-        #return sum(sorted(nx.get_edge_attributes(g, "points").values())[-4:])
-        return sum(nx.get_edge_attributes(g, "points").values())
-
-    scores = ((c, score(c)) for c in combo_graphs)
-    scores = ((c, s) for (c, s) in scores if s is not None)
+def improve_groupings(app, eg, size, groups, groupings, solver=None):
+    """Replaces the greedy groupings with the solver's, if it isn't greedy.
 
-    if return_exists:
-        return any(True for _ in scores)
+    The greedy groupings are where the exact search starts, so "timeboxed"
+    never does worse than greedy.
+    """
+    solver = solver or app.config["HANGOUT_SOLVER"]
+    if solver == "greedy":
+        return groupings
+    if solver == "exact":
+        time_limit = None
+    elif solver == "timeboxed":
+        time_limit = app.config["HANGOUT_SOLVER_TIME_LIMIT"]
+    else:
+        raise ValueError("Unknown solver {}".format(repr(solver)))
+    return wshom.packing.pack_groups(eg, size, groups=groups, initial=groupings, time_limit=time_limit)
 
-    scores = list(scores)
-    logger.debug("Found {} valid groups of {}".format(len(scores), size))
-    best_group, best_score = max(scores, key=lambda x: x[1], default=(None, None))
+def get_best_group(g, edge, size, return_exists=False):
+    debug = logger.isEnabledFor(logging.DEBUG)
+    if debug:
+        logger.debug("Get best group for {}".format(repr(edge)))
+    if return_exists:
+        return wshom.search.group_exists(g, edge, size)
 
-    if best_group is not None:
+    best_group, best_score = wshom.search.best_group(g, edge, size)
+    if debug and best_group is not None:
         logger.debug("Chosen group has score {}".format(best_score))
-        return set(best_group.nodes)
-    else:
-        return None
+    return best_group
+
+def get_groupings(g, size=4, groups=None):
+    """Greedily forms groups, best group for the highest-points edge first.
 
-def get_groupings(g, size=4):
+    If groups (from wshom.groups.load_group_index) is given, only those groups
+    are considered instead of searching the graph for them.
+    """
     orig_size = len(g.nodes)
     g = g.copy()
+    if groups is not None:
+        groups_by_edge = wshom.groups.index_by_edge(groups)
+        connectivity = wshom.connectivity.ConnectivityCache(g.has_edge)
     groupings = []
-    while True:
-        if not g.edges:
-            break
-        # Find edge with highest points
-        starting_edge, starting_points = max(nx.get_edge_attributes(g, "points").items(), key=lambda x: x[1])
-        logger.debug("Starting edge is {} with {} points".format(starting_edge, starting_points))
-        group = get_best_group(g, starting_edge, size)
+    debug = logger.isEnabledFor(logging.DEBUG)
+    # Edges come off the queue highest points first; the ones that lost an
+    # endpoint to an earlier group are skipped when popped.
+    for starting_edge, starting_points in wshom.search.edges_by_points(g):
+        if debug:
+            logger.debug("Starting edge is {} with {} points".format(starting_edge, starting_points))
+        if groups is not None:
+            group, _ = wshom.groups.best_indexed_group(g, starting_edge, groups_by_edge, connectivity)
+        else:
+            group = get_best_group(g, starting_edge, size)
         if group:
-            logger.debug("Formed a group: {}".format(group))
+            if debug:
+                logger.debug("Formed a group: {}".format(group))
             groupings.append(group)
             g.remove_nodes_from(group)
         else:
-            logger.debug("Failed to make a group")
+            if debug:
+                logger.debug("Failed to make a group")
             g.remove_edge(*starting_edge)
+            if groups is not None:
+                connectivity.edge_removed(*starting_edge)
+    logger.debug("Was able to put {} / {} eligible people into groups".format(orig_size - len(g.nodes), orig_size))
+    if groups is not None:
+        logger.debug("Connectivity cache: {}".format(connectivity.stats()))
+        wshom.metrics.count("connectivity_checks", connectivity.misses)
+        wshom.metrics.count("connectivity_cache_hits", connectivity.hits)
+    return groupings
+
+def _work_unit(g, nodes):
+    """The subgraph of g on nodes, built the way g.copy() builds its graph.
+
+    This keeps every node's neighbors in the order g.copy() would give them,
+    so searches break ties exactly as they would on the whole graph.
+    """
+    unit = g.__class__()
+    unit.graph.update(g.graph)
+    unit.add_nodes_from((n, d) for (n, d) in g.nodes(data=True) if n in nodes)
+    unit.add_edges_from((u, v, d) for u in unit for (v, d) in g.adj[u].items() if v in nodes)
+    return unit
+
+def _pack_components(g, n_units):
+    """Packs connected components into n_units sets of nodes, balanced by edge count."""
+    components = [c for c in nx.connected_components(g) if len(c) > 1]
+    costs = [(g.subgraph(c).number_of_edges(), min(c), i) for (i, c) in enumerate(components)]
+    units = [(0, i, set()) for i in range(min(n_units, len(components)))]
+    # Largest component first onto the least loaded unit
+    for cost, _, i in sorted(costs, key=lambda x: (-x[0], x[2])):
+        load, j, nodes = heapq.heappop(units)
+        nodes |= components[i]
+        heapq.heappush(units, (load + cost, j, nodes))
+    return [nodes for (_, _, nodes) in sorted(units, key=lambda x: x[1]) if nodes]
+
+def get_groupings_parallel(g, size=4, groups=None, workers=2):
+    """get_groupings, solving independent connected components in a process pool.
+
+    Returns the same groupings in the same order as get_groupings(g, size, groups).
+    """
+    units = [_work_unit(g, nodes) for nodes in _pack_components(g, workers * 4)]
+    unit_groups = [None] * len(units)
+    if groups is not None:
+        unit_groups = [[group for group in groups if all(n in unit for n in group)] for unit in units]
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(get_groupings, units, [size] * len(units), unit_groups))
+
+    # Each group was formed when its starting edge came off the queue, and no
+    # edge inside a group can come off the queue before it, so the serial
+    # order is by each group's highest priority internal edge.
+    rank = {e: i for (i, e) in enumerate(g.edges)}
+    def priority(group):
+        return min((-g.edges[u, v]["points"], rank[u, v] if (u, v) in rank else rank[v, u]) for (u, v) in g.subgraph(group).edges)
+
+    groupings = [group for result in results for group in result]
+    groupings.sort(key=priority)
+    logger.debug("Was able to put {} / {} eligible people into groups".format(sum(len(group) for group in groupings), len(g.nodes)))
+    return groupings
+
+def migrate_points_to_last_day(app, last_run_day=None):
+    """Converts the old integer points columns to last_day, and edge rows
+    saved as (higher id, lower id) to (lower id, higher id).
+
+    The stored points are as of the last arrange_hangouts run (yesterday by
+    default), so the last day is that day minus the points. Running it again
+    only converts edge rows.
+    """
+    if last_run_day is None:
+        last_run_day = today() - 1
+    inspector = sqlalchemy.inspect(db.engine)
+    for table in (GraphNode.__tablename__, GraphEdge.__tablename__):
+        columns = [c["name"] for c in inspector.get_columns(table)]
+        if "points" not in columns:
+            continue
+        if "last_day" not in columns:
+            db.session.execute(db.text("ALTER TABLE {} ADD COLUMN last_day INTEGER".format(table)))
+        db.session.execute(db.text("UPDATE {} SET last_day = :day - points".format(table)), {"day": last_run_day})
+        db.session.execute(db.text("ALTER TABLE {} DROP COLUMN points".format(table)))
+
+    # Where an edge has rows both ways, the later last day wins
+    reversed_row = "SELECT {} FROM graph_edges r WHERE r.user_a_id = graph_edges.user_b_id AND r.user_b_id = graph_edges.user_a_id"
+    db.session.execute(db.text("UPDATE graph_edges SET last_day = ({}) WHERE user_a_id < user_b_id AND EXISTS ({})".format(
+        reversed_row.format("r.last_day"), reversed_row.format("1") + " AND r.last_day > graph_edges.last_day")))
+    db.session.execute(db.text("INSERT INTO graph_edges (user_a_id, user_b_id, last_day) SELECT user_b_id, user_a_id, last_day FROM graph_edges "
+                               "WHERE user_a_id > user_b_id AND NOT EXISTS ({})".format(reversed_row.format("1"))))
+    db.session.execute(db.text("DELETE FROM graph_edges WHERE user_a_id > user_b_id"))
+    db.session.commit()
@@ -0,0 +1,192 @@
+from wshom.model import GraphGroup, GraphGroupIndex, friendship, graph_group_members
+from wshom.extensions import db
+import datetime
+import logging
+import networkx as nx
+import wshom.search
+
+logger = logging.getLogger(__name__)
+
+# Persisted index of every group of friends that could hang out together,
+# i.e. every set of `size` users whose mutual friendships form a
+# 2-edge-connected subgraph. It only depends on the friendship graph, so it
+# is updated when friendships change instead of being searched for nightly.
+#
+# The index is only complete once rebuild_group_index has run for the size,
+# which it records in graph_group_indexes. Until then (e.g. on a database
+# from before the index existed), load_group_index returns None and groups
+# are searched for instead. Only one size is kept up to date, so changing the
+# index for one size forgets that any other was built.
+
+def group_key(group):
+    return ",".join(str(n) for n in sorted(group))
+
+def _mutual_friendships(user_ids=None, friend_ids=None):
+    f1 = friendship.alias()
+    f2 = friendship.alias()
+    q = db.session.query(f1.c.user_id, f1.c.friend_id).join(f2, db.and_(
+        f1.c.user_id == f2.c.friend_id,
+        f1.c.friend_id == f2.c.user_id))
+    if user_ids is not None:
+        q = q.filter(f1.c.user_id.in_(user_ids))
+    if friend_ids is not None:
+        q = q.filter(f1.c.friend_id.in_(friend_ids))
+    return q
+
+def mutual_friends_graph(nodes=None, depth=None):
+    """Undirected graph of mutual friendships.
+
+    With nodes and depth, only loads users within depth hops of nodes (and
+    every friendship between them).
+    """
+    g = nx.Graph()
+    if nodes is None:
+        g.add_edges_from(_mutual_friendships())
+        return g
+
+    seen = set(nodes)
+    frontier = set(nodes)
+    g.add_nodes_from(nodes)
+    for _ in range(depth):
+        if not frontier:
+            break
+        frontier = set(v for (u, v) in _mutual_friendships(frontier) if v not in seen)
+        seen |= frontier
+    g.add_edges_from(_mutual_friendships(seen, seen))
+    return g
+
+def _insert_groups(groups, size):
+    keys = {group_key(group): group for group in groups}
+    if not keys:
+        return 0
+    existing = set(k for (k,) in db.session.query(GraphGroup.key).filter(GraphGroup.key.in_(keys)))
+    new_groups = [GraphGroup(key=k, size=size) for k in keys if k not in existing]
+    db.session.add_all(new_groups)
+    db.session.flush()
+    members = [{"group_id": gg.id, "user_id": n} for gg in new_groups for n in keys[gg.key]]
+    if members:
+        db.session.execute(graph_group_members.insert(), members)
+    return len(new_groups)
+
+def _delete_groups(group_ids):
+    if not group_ids:
+        return
+    db.session.execute(graph_group_members.delete().where(graph_group_members.c.group_id.in_(group_ids)))
+    GraphGroup.query.filter(GraphGroup.id.in_(group_ids)).delete(synchronize_session=False)
+
+def _forget_other_sizes(size):
+    # Only groups of size are kept up to date, so indexes of other sizes stop
+    # counting as built as soon as the index changes
+    GraphGroupIndex.query.filter(GraphGroupIndex.size != size).delete(synchronize_session=False)
+
+def rebuild_group_index(app, size):
+    """Recompute the whole index of groups of size from the friendship graph."""
+    _forget_other_sizes(size)
+    _delete_groups([i for (i,) in db.session.query(GraphGroup.id).filter(GraphGroup.size == size)])
+    g = mutual_friends_graph()
+    groups = {}
+    for edge in g.edges:
+        for group in wshom.search.groups_containing(g, edge, size):
+            groups.setdefault(group_key(group), group)
+    _insert_groups(list(groups.values()), size)
+    db.session.merge(GraphGroupIndex(size=size, built_at=datetime.datetime.utcnow()))
+    db.session.commit()
+    return len(groups)
+
+def friendship_added(u, v, size):
+    """Index the groups made possible by a new mutual friendship u-v.
+
+    Adding an edge can only create groups that contain both its ends.
+    """
+    _forget_other_sizes(size)
+    g = mutual_friends_graph([u, v], size - 2)
+    if not g.has_edge(u, v):
+        return 0
+    return _insert_groups(wshom.search.groups_containing(g, (u, v), size), size)
+
+def friendships_added(edges, size):
+    """friendship_added for many new mutual friendships at once, loading
+    their neighborhoods in one pass.
+    """
+    edges = list(edges)
+    if not edges:
+        return 0
+    _forget_other_sizes(size)
+    g = mutual_friends_graph(set(n for edge in edges for n in edge), size - 2)
+    groups = {}
+    for edge in edges:
+        if g.has_edge(*edge):
+            for group in wshom.search.groups_containing(g, edge, size):
+                groups.setdefault(group_key(group), group)
+    return _insert_groups(list(groups.values()), size)
+
+def friendship_removed(u, v, size):
+    """Drop the groups that stop being valid without mutual friendship u-v.
+
+    Removing an edge can only break groups that contain both its ends.
+    """
+    _forget_other_sizes(size)
+    m1 = graph_group_members.alias()
+    m2 = graph_group_members.alias()
+    group_ids = [i for (i,) in db.session.query(m1.c.group_id)
+        .join(m2, m1.c.group_id == m2.c.group_id)
+        .filter(m1.c.user_id == u, m2.c.user_id == v)]
+    if not group_ids:
+        return 0
+
+    groups = {}
+    for group_id, user_id in db.session.query(graph_group_members).filter(graph_group_members.c.group_id.in_(group_ids)):
+        groups.setdefault(group_id, set()).add(user_id)
+    nodes = set().union(*groups.values())
+    g = nx.Graph()
+    g.add_nodes_from(nodes)
+    g.add_edges_from(_mutual_friendships(nodes, nodes))
+
+    broken = [i for (i, group) in groups.items() if not nx.is_k_edge_connected(g.subgraph(group), 2)]
+    _delete_groups(broken)
+    return len(broken)
+
+def load_group_index(size):
+    """Returns every indexed group of the given size, in index order, or None
+    if the index hasn't been built for that size.
+    """
+    if db.session.query(GraphGroupIndex.size).filter_by(size=size).first() is None:
+        logger.warning("The group index hasn't been built for groups of {}, so groups will be searched for. Run build_group_index.py".format(size))
+        return None
+    groups = {}
+    q = db.session.query(graph_group_members).join(GraphGroup).filter(GraphGroup.size == size).order_by(GraphGroup.id)
+    for group_id, user_id in q:
+        groups.setdefault(group_id, set()).add(user_id)
+    return list(groups.values())
+
+def index_by_edge(groups):
+    """Maps each pair of users to the groups containing both of them."""
+    by_edge = {}
+    for group in groups:
+        members = sorted(group)
+        for i, a in enumerate(members):
+            for b in members[i + 1:]:
+                by_edge.setdefault((a, b), []).append(group)
+    return by_edge
+
+def best_indexed_group(g, edge, groups_by_edge, connectivity=None):
+    """Like wshom.search.best_group, but only scores indexed groups.
+
+    Returns (group, score) for the highest scoring group whose members are all
+    still in g, or (None, None). connectivity is an optional
+    wshom.connectivity.ConnectivityCache for g.
+    """
+    best_group, best_score = None, None
+    for group in groups_by_edge.get(tuple(sorted(edge)), []):
+        if not all(n in g for n in group):
+            continue
+        gg = g.subgraph(group)
+        if connectivity is not None:
+            if not connectivity.is_two_edge_connected(group):
+                continue
+        elif not nx.is_k_edge_connected(gg, 2):
+            continue
+        score = sum(nx.get_edge_attributes(gg, "points").values())
+        if best_score is None or score > best_score:
+            best_group, best_score = group, score
+    return best_group, best_score
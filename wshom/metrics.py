@@ -0,0 +1,201 @@
+import collections
+import contextlib
+import cProfile
+import json
+import logging
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Metrics and profiling for scheduling runs.
+#
+# While a run is instrumented, `active` holds its Metrics: time per phase,
+# counters and histograms, which the scheduling code reports through the
+# module functions below. Otherwise `active` is None and those functions
+# return right away, so uninstrumented runs pay one check per call. Hot loops
+# keep their own tallies and report them once per search rather than per
+# step.
+#
+# instrument() turns this on for a run according to HANGOUT_METRICS ("json"
+# or "prometheus") and HANGOUT_PROFILE ("cprofile" or "sampling").
+
+active = None
+
+BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            i = len(self.buckets)
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """[(upper bound, count of values <= it)], ending with infinity."""
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets + [float("inf")], self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+class Metrics:
+    def __init__(self):
+        self.phases = collections.OrderedDict()
+        self.counters = collections.OrderedDict()
+        self.histograms = collections.OrderedDict()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0) + time.perf_counter() - start
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name, value):
+        if name not in self.histograms:
+            self.histograms[name] = Histogram()
+        self.histograms[name].observe(value)
+
+    def to_json(self):
+        return json.dumps({
+            "phases": self.phases,
+            "counters": self.counters,
+            "histograms": {name: {
+                "buckets": {("+Inf" if bound == float("inf") else str(bound)): count for (bound, count) in h.cumulative()},
+                "sum": h.sum,
+                "count": h.count,
+            } for (name, h) in self.histograms.items()},
+        }, indent=2)
+
+    def to_prometheus(self, prefix="wshom_"):
+        lines = ["# TYPE {}phase_seconds gauge".format(prefix)]
+        for name, seconds in self.phases.items():
+            lines.append('{}phase_seconds{{phase="{}"}} {}'.format(prefix, name, seconds))
+        for name, value in self.counters.items():
+            lines.append("# TYPE {}{}_total counter".format(prefix, name))
+            lines.append("{}{}_total {}".format(prefix, name, value))
+        for name, h in self.histograms.items():
+            lines.append("# TYPE {}{} histogram".format(prefix, name))
+            for bound, count in h.cumulative():
+                lines.append('{}{}_bucket{{le="{}"}} {}'.format(prefix, name, "+Inf" if bound == float("inf") else bound, count))
+            lines.append("{}{}_sum {}".format(prefix, name, h.sum))
+            lines.append("{}{}_count {}".format(prefix, name, h.count))
+        return "\n".join(lines) + "\n"
+
+def phase(name):
+    if active is None:
+        return contextlib.nullcontext()
+    return active.phase(name)
+
+def count(name, n=1):
+    if active is not None:
+        active.count(name, n)
+
+def observe(name, value):
+    if active is not None:
+        active.observe(name, value)
+
+@contextlib.contextmanager
+def collect():
+    """Makes a new Metrics active for the duration."""
+    global active
+    previous, active = active, Metrics()
+    try:
+        yield active
+    finally:
+        active = previous
+
+class SamplingProfiler:
+    """Samples the calling thread's stack every interval seconds from a
+    background thread, and counts each stack seen.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.thread_id = threading.get_ident()
+        self.stopping = threading.Event()
+        self.sampler = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self.stopping.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append("{}:{}".format(frame.f_code.co_filename, frame.f_code.co_name))
+                frame = frame.f_back
+            self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self.sampler.start()
+
+    def stop(self):
+        self.stopping.set()
+        self.sampler.join()
+
+    def dump(self, path):
+        """Writes the stacks in the folded format flame graph tools read."""
+        with open(path, "w") as f:
+            for stack, samples in self.stacks.most_common():
+                f.write("{} {}\n".format(stack, samples))
+
+@contextlib.contextmanager
+def instrument(app, name):
+    """Collects metrics and/or a profile for the run inside, as configured."""
+    metrics_format = app.config["HANGOUT_METRICS"]
+    profile = app.config["HANGOUT_PROFILE"]
+
+    with contextlib.ExitStack() as stack:
+        metrics = stack.enter_context(collect()) if metrics_format else None
+        if profile == "cprofile":
+            profiler = cProfile.Profile()
+            profiler.enable()
+        elif profile == "sampling":
+            profiler = SamplingProfiler()
+            profiler.start()
+        elif profile:
+            raise ValueError("Unknown profiler {}".format(repr(profile)))
+
+        try:
+            yield metrics
+        finally:
+            if profile == "cprofile":
+                profiler.disable()
+                path = "{}.prof".format(name)
+                profiler.dump_stats(path)
+            elif profile == "sampling":
+                profiler.stop()
+                path = "{}.folded".format(name)
+                profiler.dump(path)
+            if profile:
+                logger.info("Wrote {} profile to {}".format(profile, path))
+
+            if metrics_format:
+                if metrics_format == "json":
+                    report = metrics.to_json()
+                elif metrics_format == "prometheus":
+                    report = metrics.to_prometheus()
+                else:
+                    raise ValueError("Unknown metrics format {}".format(repr(metrics_format)))
+                if app.config["HANGOUT_METRICS_PATH"]:
+                    with open(app.config["HANGOUT_METRICS_PATH"], "w") as f:
+                        f.write(report)
+                else:
+                    logger.info("Metrics for {}:\n{}".format(name, report))
@@ -35,11 +35,64 @@ class GraphNode(db.Model):
     __tablename__ = "graph_nodes"
 
     user_id = db.Column(db.Integer, db.ForeignKey("users.id"), primary_key=True, nullable=False)
-    points = db.Column(db.Integer, nullable=False, default=0)
+    last_day = db.Column(db.Integer, nullable=False) # Day number (date.toordinal()) of the last hangout
 
 class GraphEdge(db.Model):
     __tablename__ = "graph_edges"
 
     user_a_id = db.Column(db.Integer, db.ForeignKey("users.id"), primary_key=True, nullable=False)
     user_b_id = db.Column(db.Integer, db.ForeignKey("users.id"), primary_key=True, nullable=False)
-    points = db.Column(db.Integer, nullable=False, default=0)
+    last_day = db.Column(db.Integer, nullable=False)
+
+graph_group_members = db.Table(
+    "graph_group_members", db.metadata,
+    db.Column("group_id", db.Integer, db.ForeignKey("graph_groups.id"), primary_key=True, nullable=False),
+    db.Column("user_id", db.Integer, db.ForeignKey("users.id"), primary_key=True, index=True, nullable=False)
+)
+
+class GraphGroup(db.Model):
+    __tablename__ = "graph_groups"
+
+    id = db.Column(db.Integer, primary_key=True, nullable=False)
+    key = db.Column(db.String(240), index=True, unique=True, nullable=False)
+    size = db.Column(db.Integer, nullable=False)
+
+class GraphGroupIndex(db.Model):
+    __tablename__ = "graph_group_indexes"
+
+    size = db.Column(db.Integer, primary_key=True, nullable=False) # Group size rebuild_group_index has built the index for
+    built_at = db.Column(db.DateTime, nullable=False)
+
+class Notification(db.Model):
+    __tablename__ = "notifications"
+
+    id = db.Column(db.Integer, primary_key=True, nullable=False)
+    key = db.Column(db.String(255), index=True, unique=True, nullable=False) # Idempotency key
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
+    day = db.Column(db.Integer, nullable=False)
+    members = db.Column(db.String(240), nullable=False) # wshom.groups.group_key of the group
+    status = db.Column(db.String(16), index=True, nullable=False, default="pending") # pending, sent or failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt = db.Column(db.DateTime, nullable=False)
+    last_error = db.Column(db.String(240), nullable=False, default="")
+
+class HangoutPlan(db.Model):
+    __tablename__ = "hangout_plans"
+
+    id = db.Column(db.Integer, primary_key=True, nullable=False)
+    first_day = db.Column(db.Integer, nullable=False)
+    last_day = db.Column(db.Integer, nullable=False)
+    applied_day = db.Column(db.Integer, nullable=False) # Last day arranged from this plan
+
+class PlannedGroup(db.Model):
+    __tablename__ = "planned_groups"
+
+    id = db.Column(db.Integer, primary_key=True, nullable=False)
+    plan_id = db.Column(db.Integer, db.ForeignKey("hangout_plans.id"), index=True, nullable=False)
+    day = db.Column(db.Integer, nullable=False)
+    members = db.Column(db.String(240), nullable=False) # wshom.groups.group_key of the group
+
+class PlanInvalidation(db.Model):
+    __tablename__ = "plan_invalidations"
+
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), primary_key=True, nullable=False)
@@ -0,0 +1,169 @@
+from wshom.model import User, Notification
+from wshom.extensions import db
+import asyncio
+import concurrent.futures
+import datetime
+import email.message
+import logging
+import smtplib
+import wshom.upserts
+
+logger = logging.getLogger(__name__)
+
+# Outbox of hangout notifications.
+#
+# arrange_hangouts adds one row per person in each day's groups, in the same
+# transaction that saves their points, so a day's groups are either both
+# saved and queued or neither. Each row has an idempotency key (day, group,
+# person): running a day again queues nothing new, and the key goes out as
+# the message's Message-ID, so a message sent again after a crash between
+# sending and marking it sent can be recognized as a duplicate.
+#
+# dispatch drains the outbox with asyncio: it claims due rows in batches and
+# sends each batch over a fixed pool of SMTP connections, each used from its
+# own worker thread. Failed sends are retried with exponential backoff until
+# NOTIFY_MAX_ATTEMPTS, then marked failed.
+
+def notification_key(day, group, user_id):
+    # Also the local part of the Message-ID, so only dots and dashes
+    return "{}.{}.{}".format(day, "-".join(str(n) for n in sorted(group)), user_id)
+
+def enqueue_hangouts(day, groupings):
+    """Adds notifications for groupings to the session (without committing)."""
+    import wshom.groups
+    now = datetime.datetime.utcnow()
+    rows = [{
+        "key": notification_key(day, group, n),
+        "user_id": n,
+        "day": day,
+        "members": wshom.groups.group_key(group),
+        "status": "pending",
+        "attempts": 0,
+        "next_attempt": now,
+        "last_error": "",
+    } for group in groupings for n in sorted(group)]
+    wshom.upserts.insert_ignoring_conflicts(Notification.__table__, ["key"], rows)
+
+def _claim(batch_size):
+    # Where the database supports it, the batch stays locked until its results
+    # are committed, and concurrent dispatchers skip it.
+    now = datetime.datetime.utcnow()
+    return (Notification.query
+        .filter(Notification.status == "pending", Notification.next_attempt <= now)
+        .order_by(Notification.id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+        .all())
+
+def _messages(app, notifications):
+    """Builds the email for each notification, with two queries per batch."""
+    user_ids = set(n.user_id for n in notifications)
+    for n in notifications:
+        user_ids.update(int(i) for i in n.members.split(","))
+    users = {u.id: u for u in User.query.filter(User.id.in_(user_ids))}
+
+    messages = []
+    for n in notifications:
+        recipient = users[n.user_id]
+        others = [users[int(i)] for i in n.members.split(",") if int(i) != n.user_id]
+        names = [u.display_name or u.username for u in others]
+        msg = email.message.EmailMessage()
+        msg["From"] = app.config["MAIL_FROM"]
+        msg["To"] = recipient.email
+        msg["Subject"] = "Time to hang out"
+        msg["Message-ID"] = "<{}@wshom>".format(n.key)
+        msg.set_content("You should hang out with {} and {}.".format(", ".join(names[:-1]), names[-1]) if len(names) > 1 else
+                        "You should hang out with {}.".format(names[0]))
+        messages.append(msg)
+    return messages
+
+class SMTPPool:
+    """concurrency SMTP connections, each used by one send at a time."""
+
+    def __init__(self, host, port, concurrency):
+        self.host = host
+        self.port = port
+        self.executor = concurrent.futures.ThreadPoolExecutor(concurrency)
+        self.idle = asyncio.Queue()
+        for _ in range(concurrency):
+            self.idle.put_nowait(None) # Connected on first use
+
+    def _send(self, smtp, msg):
+        if smtp is None:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=30)
+        try:
+            smtp.send_message(msg)
+        except Exception:
+            smtp.close()
+            raise
+        return smtp
+
+    async def send(self, msg):
+        smtp = await self.idle.get()
+        try:
+            smtp = await asyncio.get_running_loop().run_in_executor(self.executor, self._send, smtp, msg)
+        except Exception:
+            smtp = None
+            raise
+        finally:
+            self.idle.put_nowait(smtp)
+
+    def close(self):
+        while not self.idle.empty():
+            smtp = self.idle.get_nowait()
+            if smtp is not None:
+                try:
+                    smtp.quit()
+                except smtplib.SMTPException:
+                    smtp.close()
+        self.executor.shutdown()
+
+async def _send(pool, msg):
+    try:
+        await pool.send(msg)
+        return None
+    except (OSError, smtplib.SMTPException) as e:
+        return e
+
+async def dispatch(app, pool=None):
+    """Sends the due notifications, in batches, until none are left.
+
+    Returns (sent, failed) counts. Notifications whose retries aren't due yet
+    are left for a later run.
+    """
+    config = app.config
+    if pool is None:
+        pool = SMTPPool(config["MAIL_SERVER"], config["MAIL_PORT"], config["NOTIFY_CONCURRENCY"])
+        owned = True
+    else:
+        owned = False
+
+    sent = failed = 0
+    try:
+        while True:
+            notifications = _claim(config["NOTIFY_BATCH_SIZE"])
+            if not notifications:
+                break
+            messages = _messages(app, notifications)
+            errors = await asyncio.gather(*(_send(pool, msg) for msg in messages))
+
+            now = datetime.datetime.utcnow()
+            for n, error in zip(notifications, errors):
+                n.attempts += 1
+                if error is None:
+                    n.status = "sent"
+                    sent += 1
+                    continue
+                n.last_error = str(error)[:240]
+                if n.attempts >= config["NOTIFY_MAX_ATTEMPTS"]:
+                    n.status = "failed"
+                    failed += 1
+                    logger.warning("Giving up on notification {}: {}".format(n.key, n.last_error))
+                else:
+                    n.next_attempt = now + datetime.timedelta(seconds=config["NOTIFY_RETRY_DELAY"] * 2 ** (n.attempts - 1))
+            db.session.commit()
+    finally:
+        if owned:
+            pool.close()
+    logger.info("Sent {} notifications, {} failed".format(sent, failed))
+    return sent, failed
@@ -0,0 +1,150 @@
+import itertools
+import networkx as nx
+import logging
+import time
+import wshom.connectivity
+import wshom.search
+
+logger = logging.getLogger(__name__)
+
+# Exact group assignment as weighted set packing.
+#
+# Every valid group in the eligible graph is a candidate, weighted by the
+# points on its edges (the score get_best_group maximizes). A day's schedule
+# is a set of candidates with no person in two of them; this finds the one
+# with the most total points by branch and bound, starting from the greedy
+# schedule and stopping early if it runs out of time.
+
+def candidate_groups(g, size, groups=None, deadline=None):
+    """Returns [(group, weight)] for every valid group in g, or None if the
+    deadline (from time.monotonic) passes first.
+
+    If groups (from wshom.groups.load_group_index) is given, candidates are
+    taken from it instead of searched for.
+    """
+    if groups is None:
+        found = {}
+        for edge in g.edges:
+            if deadline is not None and time.monotonic() > deadline:
+                return None
+            for group in wshom.search.groups_containing(g, edge, size):
+                found.setdefault(frozenset(group), group)
+        groups = found.values()
+
+    # Each group is only checked once, so nothing is kept in the cache
+    connectivity = wshom.connectivity.ConnectivityCache(g.has_edge, maxsize=0)
+    candidates = []
+    for i, group in enumerate(groups):
+        if deadline is not None and i % 256 == 0 and time.monotonic() > deadline:
+            return None
+        if not all(n in g for n in group):
+            continue
+        if connectivity.is_two_edge_connected(group):
+            candidates.append((group, _weight(g, group)))
+    return candidates
+
+def _weight(g, group):
+    return sum(g.edges[a, b].get("points", 0) for (a, b) in itertools.combinations(group, 2) if g.has_edge(a, b))
+
+def pack_groups(g, size=4, groups=None, initial=None, time_limit=None):
+    """Returns the groups with the most total points that share no one.
+
+    initial is a known schedule (e.g. from get_groupings) to start from. With
+    a time_limit in seconds, returns the best schedule found by then, which is
+    initial if there wasn't time to find every candidate group.
+    """
+    deadline = time.monotonic() + time_limit if time_limit is not None else None
+    initial = [set(group) for group in (initial or [])]
+    candidates = candidate_groups(g, size, groups, deadline)
+    if candidates is None:
+        logger.debug("Time limit reached finding candidate groups, keeping the initial schedule")
+        return initial
+
+    # People in different components never compete for a group
+    component_of = {}
+    for i, component in enumerate(nx.connected_components(g)):
+        for n in component:
+            component_of[n] = i
+    by_component = {}
+    for group, weight in candidates:
+        by_component.setdefault(component_of[next(iter(group))], []).append((group, weight))
+    initial_by_component = {}
+    for group in initial:
+        initial_by_component.setdefault(component_of[next(iter(group))], []).append(group)
+
+    schedule = []
+    optimal = True
+    for i in sorted(by_component, key=lambda i: -len(by_component[i])):
+        start = initial_by_component.get(i, [])
+        chosen, proven = _pack(by_component[i], [(group, _weight(g, group)) for group in start], deadline)
+        schedule.extend(chosen)
+        optimal = optimal and proven
+
+    logger.debug("Packed {} groups with {} points{}".format(len(schedule), sum(_weight(g, group) for group in schedule), "" if optimal else " (time limit reached)"))
+    schedule.sort(key=lambda group: (-_weight(g, group), sorted(group)))
+    return schedule
+
+def _pack(candidates, initial, deadline):
+    """Branch and bound for one component. Returns (groups, proven optimal)."""
+    candidates = sorted(candidates, key=lambda x: -x[1])
+    groups = [set(group) for (group, _) in candidates]
+    weights = [weight for (_, weight) in candidates]
+    by_node = {}
+    for i, group in enumerate(groups):
+        for n in group:
+            by_node.setdefault(n, []).append(i)
+
+    best = [sum(weight for (_, weight) in initial), [group for (group, _) in initial]]
+    taken = set()
+    chosen = []
+
+    def available(i):
+        return taken.isdisjoint(groups[i])
+
+    def bound(free):
+        # A group's weight, shared equally among its members, is at most the
+        # best share each member could get.
+        total = 0
+        for n in free:
+            shares = [weights[i] / len(groups[i]) for i in by_node[n] if available(i)]
+            if shares:
+                total += max(shares)
+        return total
+
+    # Yields the (free, weight) subproblems to explore under this one. Run
+    # from an explicit stack below, since the search can go as deep as the
+    # component is large.
+    def branch(free, weight):
+        options = {n: [i for i in by_node[n] if available(i)] for n in free}
+        free = [n for n in free if options[n]]
+        if weight > best[0]:
+            best[:] = [weight, [groups[i] for i in chosen]]
+        if not free or weight + bound(free) <= best[0]:
+            return
+
+        # Branch on the person with the fewest options: each group they could
+        # join, or leaving them out.
+        n = free[min(range(len(free)), key=lambda k: (len(options[free[k]]), k))]
+        rest = [m for m in free if m != n]
+        for i in options[n]:
+            taken.update(groups[i])
+            chosen.append(i)
+            yield [m for m in rest if m not in groups[i]], weight + weights[i]
+            chosen.pop()
+            taken.difference_update(groups[i])
+        taken.add(n)
+        yield rest, weight
+        taken.discard(n)
+
+    stack = [branch(list(by_node), 0)]
+    explored = 0
+    while stack:
+        explored += 1
+        if deadline is not None and explored % 256 == 0 and time.monotonic() > deadline:
+            return best[1], False
+        subproblem = next(stack[-1], None)
+        if subproblem is None:
+            stack.pop()
+        else:
+            stack.append(branch(*subproblem))
+    return best[1], True
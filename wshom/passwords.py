@@ -0,0 +1,168 @@
+import collections
+import concurrent.futures
+import flask
+import threading
+import time
+import werkzeug.security
+
+# Password hashing off the request threads.
+#
+# Hashes are computed on a pool of PASSWORD_HASH_WORKERS threads (or
+# processes, with PASSWORD_HASH_EXECUTOR = "process"), so however many logins
+# arrive at once, at most that many hashes run at a time and the rest of the
+# app keeps its CPU. At most PASSWORD_HASH_QUEUE more may wait; past that,
+# hash_password and check_login raise Busy straight away and the views
+# answer 503 instead of queueing. With PASSWORD_HASH_WORKERS = 0, hashes are
+# computed inline as before.
+#
+# After LOGIN_FAILURE_LIMIT failed logins for a username within
+# LOGIN_FAILURE_WINDOW seconds, further attempts are refused without hashing
+# anything until the window ends. Failures are counted per process.
+#
+# If PASSWORD_HASH_METHOD is set, hashes made with the same algorithm but
+# other parameters (e.g. fewer iterations) are replaced with new ones the next
+# time their user logs in. Hashes made with another algorithm are left alone
+# unless PASSWORD_HASH_CHANGE_ALGORITHM is set too, so changing the setting
+# can't quietly move passwords to a weaker algorithm.
+
+class Busy(Exception):
+    """Too many hashes are already running or waiting."""
+
+class Throttled(Exception):
+    """Too many recent failed logins for the username."""
+
+def _generate(password, method):
+    if method is None:
+        return werkzeug.security.generate_password_hash(password)
+    return werkzeug.security.generate_password_hash(password, method)
+
+class Hasher:
+    """Hashes with method, or werkzeug's default method if it's None."""
+
+    def __init__(self, method, workers, queue, executor="thread", change_algorithm=False):
+        self.method = method
+        self.change_algorithm = change_algorithm
+        self.workers = workers
+        self.executor_type = executor
+        self.executor = None
+        self.executor_lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(workers + queue) if workers else None
+        self.prefix = None
+
+    def _executor(self):
+        # Made on first use, so processes aren't forked when the app is created
+        with self.executor_lock:
+            if self.executor is None:
+                if self.executor_type == "thread":
+                    self.executor = concurrent.futures.ThreadPoolExecutor(self.workers, thread_name_prefix="wshom-passwords")
+                elif self.executor_type == "process":
+                    self.executor = concurrent.futures.ProcessPoolExecutor(self.workers)
+                else:
+                    raise ValueError("Unknown executor {}".format(repr(self.executor_type)))
+            return self.executor
+
+    def _run(self, f, *args):
+        if not self.workers:
+            return f(*args)
+        if not self.slots.acquire(blocking=False):
+            raise Busy()
+        try:
+            return self._executor().submit(f, *args).result()
+        finally:
+            self.slots.release()
+
+    def hash(self, password):
+        return self._run(_generate, password, self.method)
+
+    def verify(self, pwhash, password):
+        return self._run(werkzeug.security.check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """Whether pwhash should be replaced with a hash made with method."""
+        if self.method is None:
+            return False
+        if self.prefix is None:
+            # The method with werkzeug's defaults filled in, e.g. the iterations
+            self.prefix = _generate("", self.method).split("$", 1)[0]
+        stored = pwhash.split("$", 1)[0]
+        if stored == self.prefix:
+            return False
+        return self.change_algorithm or stored.split(":", 1)[0] == self.prefix.split(":", 1)[0]
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+
+class FailureThrottle:
+    """Counts failures per key in fixed windows of window seconds, for up to
+    maxsize keys.
+    """
+
+    def __init__(self, limit, window, maxsize=10000):
+        self.limit = limit
+        self.window = window
+        self.maxsize = maxsize
+        self.failures = collections.OrderedDict() # key: (window start, failures)
+        self.lock = threading.Lock()
+
+    def _current(self, key, now):
+        entry = self.failures.get(key)
+        if entry is None or now - entry[0] >= self.window:
+            return (now, 0)
+        return entry
+
+    def blocked(self, key):
+        if not self.limit:
+            return False
+        with self.lock:
+            return self._current(key, time.monotonic())[1] >= self.limit
+
+    def failed(self, key):
+        with self.lock:
+            now = time.monotonic()
+            start, failures = self._current(key, now)
+            self.failures[key] = (start, failures + 1)
+            self.failures.move_to_end(key)
+            while len(self.failures) > self.maxsize:
+                self.failures.popitem(last=False)
+
+    def succeeded(self, key):
+        with self.lock:
+            self.failures.pop(key, None)
+
+def init_app(app):
+    config = app.config
+    app.extensions["wshom_passwords"] = (
+        Hasher(config["PASSWORD_HASH_METHOD"], config["PASSWORD_HASH_WORKERS"], config["PASSWORD_HASH_QUEUE"],
+               config["PASSWORD_HASH_EXECUTOR"], config["PASSWORD_HASH_CHANGE_ALGORITHM"]),
+        FailureThrottle(config["LOGIN_FAILURE_LIMIT"], config["LOGIN_FAILURE_WINDOW"]))
+
+def hasher():
+    return flask.current_app.extensions["wshom_passwords"][0]
+
+def throttle():
+    return flask.current_app.extensions["wshom_passwords"][1]
+
+def hash_password(password):
+    return hasher().hash(password)
+
+def check_login(user, username, password):
+    """Whether password is user's, where user is the User with username, or
+    None. Raises Throttled or Busy if it couldn't be checked.
+
+    A correct password stored with old hash parameters is rehashed (without
+    committing) if the pool has room.
+    """
+    if throttle().blocked(username):
+        raise Throttled()
+    if user is None or not hasher().verify(user.password_hash, password):
+        throttle().failed(username)
+        return False
+    throttle().succeeded(username)
+
+    if hasher().needs_rehash(user.password_hash):
+        try:
+            user.password_hash = hasher().hash(password)
+        except Busy:
+            pass # Next time
+    return True
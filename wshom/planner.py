@@ -0,0 +1,135 @@
+from wshom.model import HangoutPlan, PlannedGroup, PlanInvalidation
+from wshom.extensions import db
+import logging
+import wshom.metrics
+import wshom.upserts
+
+logger = logging.getLogger(__name__)
+
+# Arranging hangouts several days ahead (HANGOUT_PLAN_DAYS > 1).
+#
+# When there is no plan for today, the graph is solved once for each of the
+# next HANGOUT_PLAN_DAYS days, in memory, as though each day's groups had
+# hung out, with the group index loaded once for all of them. The days' groups
+# are saved as a plan. With nothing changed in between, the plan is exactly
+# what arranging each day separately would have given.
+#
+# On the days after, today's planned groups are used instead of solving
+# again. Changes to friendships and profiles mark the users involved in
+# plan_invalidations; planned groups that are no longer possible (a member
+# left, isn't eligible yet or lost a friendship the group needed) are
+# dropped, and only the people near dropped groups and marked users are
+# grouped again, greedily. Anyone whose days then differ from the plan stays
+# marked until the next plan, so later days are repaired around them too.
+#
+# A new plan is made when the last one runs out or a day was missed or run
+# twice.
+#
+# The views call invalidate, so the scheduling modules are only imported by
+# the functions that plan.
+
+def plan_hangouts(app, g, days, solver=None, groups=None):
+    """Returns the groupings for each of days days starting from g's day,
+    without changing g.
+    """
+    import wshom.graph
+    import wshom.groups
+    if groups is None:
+        with wshom.metrics.phase("load_index"):
+            groups = wshom.groups.load_group_index(app.config["HANGOUT_GROUP_SIZE"])
+    g = g.copy()
+    plan = []
+    for i in range(days):
+        if i:
+            wshom.graph.increment_points(g)
+        groupings = wshom.graph.choose_groupings(app, g, solver, groups)
+        for group in groupings:
+            wshom.graph.zero_points(g, group)
+        plan.append(groupings)
+    return plan
+
+def current_plan(day):
+    """The plan to arrange day from, or None if a new one is needed."""
+    plan = HangoutPlan.query.order_by(HangoutPlan.id.desc()).first()
+    if plan is None or not plan.first_day <= day <= plan.last_day or plan.applied_day != day - 1:
+        return None
+    return plan
+
+def save_plan(day, plan):
+    """Replaces any previous plan with plan, starting on day (without
+    committing).
+    """
+    import wshom.groups
+    db.session.query(PlannedGroup).delete()
+    db.session.query(HangoutPlan).delete()
+    db.session.query(PlanInvalidation).delete()
+    hangout_plan = HangoutPlan(first_day=day, last_day=day + len(plan) - 1, applied_day=day - 1)
+    db.session.add(hangout_plan)
+    db.session.flush()
+    db.session.execute(PlannedGroup.__table__.insert(), [
+        {"plan_id": hangout_plan.id, "day": day + i, "members": wshom.groups.group_key(group)}
+        for (i, groupings) in enumerate(plan) for group in groupings])
+    return hangout_plan
+
+def planned_groupings(plan, day):
+    return [set(int(n) for n in members.split(","))
+            for (members,) in db.session.query(PlannedGroup.members).filter_by(plan_id=plan.id, day=day).order_by(PlannedGroup.id)]
+
+def invalidate(app, user_ids):
+    """Marks user_ids as changed since the plan was made (without
+    committing). Does nothing unless plans are in use.
+    """
+    if app.config["HANGOUT_PLAN_DAYS"] <= 1:
+        return
+    rows = [{"user_id": n} for n in set(user_ids)]
+    wshom.upserts.insert_ignoring_conflicts(PlanInvalidation.__table__, ["user_id"], rows)
+
+def _still_possible(eg, group):
+    import networkx as nx
+    return all(n in eg for n in group) and nx.is_k_edge_connected(eg.subgraph(group), 2)
+
+def repair_groupings(app, g, groupings, invalidated):
+    """Returns (groupings, changed): the planned groupings that are still
+    possible in g, plus greedy groups among the people near invalidated users
+    and dropped groups. changed is everyone whose day differs from the plan.
+    """
+    import networkx as nx
+    import wshom.graph
+    size = app.config["HANGOUT_GROUP_SIZE"]
+    eg = wshom.graph.without_ineligible(g)
+    kept = [group for group in groupings if _still_possible(eg, group)]
+    dropped = set().union(*[group for group in groupings if not _still_possible(eg, group)])
+    seeds = (dropped | set(invalidated)) & set(eg.nodes)
+    if not seeds:
+        return kept, dropped
+
+    # Any new group includes a seed, so its members are at most size - 1
+    # hops from one, not counting people already in kept groups
+    free = eg.subgraph(set(eg.nodes).difference(*kept))
+    nearby = set()
+    for n in seeds & set(free.nodes):
+        nearby.update(nx.single_source_shortest_path_length(free, n, cutoff=size - 1))
+    added = wshom.graph.get_groupings(free.subgraph(nearby), size)
+    logger.info("Repaired the plan: kept {} groups, dropped {}, added {}".format(len(kept), len(groupings) - len(kept), len(added)))
+    return kept + added, dropped.union(*added)
+
+def arrange_planned_hangouts(app, day=None, solver=None):
+    """arrange_hangouts from a plan, making one first if needed."""
+    import wshom.graph
+    with wshom.metrics.phase("load"):
+        g = wshom.graph.graph_from_database(app, day)
+    day = g.graph["day"]
+
+    plan = current_plan(day)
+    if plan is None:
+        with wshom.metrics.phase("plan"):
+            days = plan_hangouts(app, g, app.config["HANGOUT_PLAN_DAYS"], solver)
+            plan = save_plan(day, days)
+        groupings = days[0]
+    else:
+        with wshom.metrics.phase("repair"):
+            invalidated = [n for (n,) in db.session.query(PlanInvalidation.user_id)]
+            groupings, changed = repair_groupings(app, g, planned_groupings(plan, day), invalidated)
+            invalidate(app, changed)
+    plan.applied_day = day
+    wshom.graph.save_groupings(app, g, groupings)
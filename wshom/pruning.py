@@ -0,0 +1,121 @@
+import collections
+import wshom.search
+
+# Removing edges that can never be in a group.
+#
+# An edge in no valid group can be dropped without changing any group, and
+# dropping it can only take groups away from other edges, so the edges to drop
+# are found by repeating this until nothing changes.
+#
+# Rather than rechecking every edge after each pass, each edge that has a
+# group remembers one (its witness). Dropping (a, b) can only break witnesses
+# containing both a and b, so only the edges with those witnesses go back on
+# the worklist.
+#
+# A 2-edge-connected group puts its seed edge on a cycle of at most size
+# edges, so edges without one are dropped without a search. Usually the
+# shortest such cycle grows into a group by adding people with two friends
+# already in it, and the full search is only needed when it doesn't.
+
+def unusable_edges(edges, size):
+    """Returns the edges (in the given orientation) that are in no group of
+    size, once all other such edges are removed.
+    """
+    adj = {}
+    oriented = {}
+    for u, v in edges:
+        adj.setdefault(u, set()).add(v)
+        adj.setdefault(v, set()).add(u)
+        oriented[(u, v)] = oriented[(v, u)] = (u, v)
+
+    witness = {}
+    witnessed_by = {} # edge -> edges whose witness contains it
+    queue = collections.deque(oriented[e] for e in edges)
+    queued = set(queue)
+    removed = []
+    while queue:
+        edge = queue.popleft()
+        queued.discard(edge)
+        u, v = edge
+        cycle = _short_cycle(adj, u, v, size)
+        group = cycle and (_grow(adj, cycle, size) or _find_group(adj, edge, size))
+        if group:
+            witness[edge] = group
+            for a in group:
+                for b in adj[a] & group:
+                    witnessed_by.setdefault(oriented[(a, b)], []).append(edge)
+            continue
+
+        adj[u].discard(v)
+        adj[v].discard(u)
+        removed.append(edge)
+        witness.pop(edge, None)
+        for e in witnessed_by.pop(edge, []):
+            group = witness.get(e)
+            if e not in queued and group is not None and u in group and v in group:
+                del witness[e]
+                queued.add(e)
+                queue.append(e)
+    return removed
+
+def _within(adj, sources, cutoff):
+    """Nodes at most cutoff edges from any of sources."""
+    seen = set(sources)
+    level = list(seen)
+    for _ in range(cutoff):
+        next_level = []
+        for n in level:
+            for m in adj[n]:
+                if m not in seen:
+                    seen.add(m)
+                    next_level.append(m)
+        level = next_level
+    return seen
+
+def _short_cycle(adj, u, v, size):
+    """Nodes of a shortest cycle through (u, v), if it has at most size
+    nodes, else None.
+    """
+    if len(adj[u]) < 2 or len(adj[v]) < 2:
+        return None
+    parent = {u: None}
+    level = [u]
+    for _ in range(size - 1):
+        next_level = []
+        for n in level:
+            for m in adj[n]:
+                if m in parent or (n == u and m == v):
+                    continue
+                parent[m] = n
+                if m == v:
+                    cycle = set()
+                    while m is not None:
+                        cycle.add(m)
+                        m = parent[m]
+                    return cycle
+                next_level.append(m)
+        level = next_level
+    return None
+
+def _grow(adj, nodes, size):
+    """Adds nodes with two neighbors already in nodes until there are size of
+    them, which keeps them 2-edge-connected. Returns None if it gets stuck.
+    """
+    nodes = set(nodes)
+    links = collections.Counter(m for n in nodes for m in adj[n] if m not in nodes)
+    while len(nodes) < size:
+        n = next((m for (m, count) in links.items() if count >= 2), None)
+        if n is None:
+            return None
+        nodes.add(n)
+        del links[n]
+        links.update(m for m in adj[n] if m not in nodes)
+    return nodes
+
+def _find_group(adj, edge, size):
+    """Some group containing edge, or None."""
+    local = list(edge) + list(_within(adj, edge, size - 2) - set(edge))
+    local_adj = wshom.search._local_adjacency(local, lambda n: ((m, 0) for m in adj[n]))
+    found = []
+    wshom.search._search_local(local, local_adj, size, find_best=False, found=found, limit=1)
+    return found[0] if found else None
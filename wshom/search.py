@@ -0,0 +1,199 @@
+import networkx as nx
+import bisect
+import heapq
+import wshom.metrics
+
+# Branch-and-bound search for hangout groups.
+#
+# A group is a set of `size` people containing a seed edge whose induced
+# subgraph is 2-edge-connected. Its score is the sum of "points" over the
+# edges inside the group.
+#
+# Candidates are enumerated in the same order as
+# itertools.combinations(candidate_nodes(...), size - 2), and a group only
+# replaces the current best if it scores strictly higher, so the result is
+# the same group that max() over the brute-force enumeration would pick.
+
+def candidate_nodes(g, edge, size):
+    """Nodes (other than the seed edge) that could appear in a group."""
+    max_depth = size - 1
+    (n1, n2) = [nx.single_source_shortest_path_length(g, n, cutoff=max_depth - 1) for n in edge]
+    nodes = set(n1).union(n2)
+    nodes -= set(edge)
+    return list(nodes)
+
+def best_group(g, edge, size):
+    """Returns (group, score) for the best group containing edge, or (None, None)."""
+    return _search(g, edge, size, find_best=True)
+
+def group_exists(g, edge, size):
+    """Returns True if any valid group contains edge."""
+    return _search(g, edge, size, find_best=False)
+
+def groups_containing(g, edge, size):
+    """Returns every valid group containing edge, in enumeration order."""
+    groups = []
+    _search(g, edge, size, find_best=False, found=groups)
+    return groups
+
+def edges_by_points(g):
+    """Yields (edge, points) from most to fewest points, ties in g.edges order.
+
+    This is the order in which repeatedly taking max() over the remaining edges
+    would visit them. g may lose nodes and edges between steps; entries for
+    removed edges are dropped as they come off the heap.
+    """
+    heap = [(-points, rank, edge) for (rank, (edge, points)) in enumerate(nx.get_edge_attributes(g, "points").items())]
+    heapq.heapify(heap)
+    while heap:
+        points, _, edge = heapq.heappop(heap)
+        if g.has_edge(*edge):
+            yield edge, -points
+
+def _is_two_edge_connected(nodes, adj):
+    """Bridge check on a small set of local node indices."""
+    nodes = set(nodes)
+    order = {}
+
+    def visit(n, parent):
+        order[n] = low = len(order)
+        for m in adj[n]:
+            if m not in nodes or m == parent:
+                continue
+            if m in order:
+                low = min(low, order[m])
+            else:
+                m_low = visit(m, n)
+                if m_low is None or m_low > order[n]:
+                    return None
+                low = min(low, m_low)
+        return low
+
+    if visit(next(iter(nodes)), None) is None:
+        return False
+    return len(order) == len(nodes)
+
+def _search(g, edge, size, find_best, found=None):
+    local = list(edge) + candidate_nodes(g, edge, size)
+    adj = _local_adjacency(local, lambda n: ((m, data.get("points", 0)) for (m, data) in g.adj[n].items()))
+    return _search_local(local, adj, size, find_best, found)
+
+def _local_adjacency(local, neighbors):
+    """Adjacency among local, as a list of {local index: points} dicts.
+
+    neighbors(n) yields (neighbor, points) pairs.
+    """
+    index = {n: i for i, n in enumerate(local)}
+    adj = [{} for _ in local]
+    for i, n in enumerate(local):
+        for m, points in neighbors(n):
+            j = index.get(m)
+            if j is not None and j != i:
+                adj[i][j] = points
+    return adj
+
+def _search_local(local, adj, size, find_best, found=None, limit=None):
+    # Local indices: 0 and 1 are the seed edge, the rest are candidates in
+    # enumeration order. If found is a list, groups are collected into it
+    # (the first limit of them, if limit is given).
+    count = len(local)
+    sorted_adj = [sorted(a) for a in adj]
+
+    # potential[j][k] is the most that k more edges from j to other
+    # candidates could add to the score.
+    potential = []
+    for a in adj:
+        weights = sorted((w for (j, w) in a.items() if j >= 2 and w > 0), reverse=True)
+        prefix = [0]
+        for w in weights:
+            prefix.append(prefix[-1] + w)
+        potential.append(prefix)
+
+    members = []
+    member_degree = [0] * count # Number of neighbors among members
+    gain = [0] * count # Points on edges to members
+
+    def add(i):
+        members.append(i)
+        for j, w in adj[i].items():
+            member_degree[j] += 1
+            gain[j] += w
+
+    def remove(i):
+        members.pop()
+        for j, w in adj[i].items():
+            member_degree[j] -= 1
+            gain[j] -= w
+
+    def pool(start, remaining):
+        # A node picked with k slots left after it can gain at most k more
+        # neighbors, so it needs at least 2 - k neighbors among the members
+        # when it is picked, and at least 3 - remaining right now.
+        floor = 3 - remaining
+        if floor > 0:
+            return sorted({j for m in members for j in adj[m] if j >= start and member_degree[j] >= floor})
+        return range(start, count)
+
+    def feasible(start, remaining):
+        # Every member needs degree >= 2 in the finished group
+        for m in members:
+            later = len(sorted_adj[m]) - bisect.bisect_left(sorted_adj[m], start)
+            if member_degree[m] + min(remaining, later) < 2:
+                return False
+        return True
+
+    def bound(start, remaining, score):
+        if remaining == 0:
+            return score
+        values = (gain[j] + potential[j][min(remaining - 1, len(potential[j]) - 1)] for j in pool(start, remaining))
+        return score + sum(heapq.nlargest(remaining, values))
+
+    best = [None, None]
+    examined = [0, 0] # Combinations tried, and how many were full groups
+
+    def extend(start, remaining, score):
+        if remaining == 0:
+            examined[1] += 1
+            if not _is_two_edge_connected(members, adj):
+                return False
+            if find_best and (best[1] is None or score > best[1]):
+                best[:] = [list(members), score]
+            if found is not None:
+                found.append(set(local[i] for i in members))
+                return limit is not None and len(found) >= limit
+            return True
+
+        for i in pool(start, remaining):
+            if i > count - remaining:
+                break
+            new_score = score + gain[i]
+            examined[0] += 1
+            add(i)
+            if feasible(i + 1, remaining - 1):
+                if not find_best:
+                    if extend(i + 1, remaining - 1, new_score):
+                        remove(i)
+                        return True
+                elif best[1] is None or bound(i + 1, remaining - 1, new_score) > best[1]:
+                    extend(i + 1, remaining - 1, new_score)
+            remove(i)
+        return False
+
+    if size < 2 or count < size:
+        return (None, None) if find_best else False
+
+    add(0)
+    add(1)
+    exists = extend(2, size - 2, adj[0].get(1, 0))
+
+    if wshom.metrics.active is not None:
+        wshom.metrics.count("searches")
+        wshom.metrics.count("combinations_examined", examined[0])
+        wshom.metrics.count("connectivity_checks", examined[1])
+        wshom.metrics.observe("search_candidates", count - 2)
+
+    if not find_best:
+        return exists
+    if best[0] is None:
+        return None, None
+    return set(local[i] for i in best[0]), best[1]
@@ -0,0 +1,77 @@
+from wshom.model import User
+from wshom.extensions import db
+import datetime
+import logging
+import pytz
+import wshom.graph
+
+logger = logging.getLogger(__name__)
+
+# Scheduling each timezone in its own evening.
+#
+# Instead of one global run, users are split into shards by their current UTC
+# offset (so New York and Toronto share a shard, and shards follow daylight
+# saving time), and each shard is arranged on its own around
+# HANGOUT_LOCAL_HOUR local time. A shard's run loads and saves only its own
+# users and the friendships between them.
+#
+# Groups never span shards. A friendship between users in different shards
+# belongs to neither: no sharded run schedules it or writes its row, so it
+# keeps its points. Friends whose clocks differ are rarely in the same place
+# for an evening anyway.
+#
+# Users without a timezone count as HANGOUT_DEFAULT_TIMEZONE.
+#
+# arrange_due_shards is meant to run every 30 minutes (from cron, say), and
+# runs the shards whose local time is in the first half hour of
+# HANGOUT_LOCAL_HOUR. Rerunning a shard on the same day forms no new groups,
+# since the first run leaves no group among the people it didn't schedule.
+
+def _zone(app, tzname):
+    try:
+        return pytz.timezone(tzname or app.config["HANGOUT_DEFAULT_TIMEZONE"])
+    except pytz.UnknownTimeZoneError:
+        logger.warning("Unknown timezone {}, using {}".format(repr(tzname), app.config["HANGOUT_DEFAULT_TIMEZONE"]))
+        return pytz.timezone(app.config["HANGOUT_DEFAULT_TIMEZONE"])
+
+def utc_offset(app, tzname, when):
+    """tzname's UTC offset in minutes at the UTC datetime when."""
+    if when.tzinfo is None:
+        when = pytz.utc.localize(when)
+    offset = when.astimezone(_zone(app, tzname)).utcoffset()
+    return int(offset.total_seconds()) // 60
+
+def timezone_shards(app, when=None):
+    """Maps each UTC offset (in minutes) at when to the timezones of active
+    users that have it.
+    """
+    if when is None:
+        when = datetime.datetime.utcnow()
+    shards = {}
+    for (tzname,) in db.session.query(User.timezone).filter(User.active == True).distinct():
+        shards.setdefault(utc_offset(app, tzname, when), []).append(tzname)
+    return shards
+
+def local_day(offset, when):
+    """Day number of the local date at UTC offset (in minutes) at when."""
+    return (when + datetime.timedelta(minutes=offset)).date().toordinal()
+
+def due_shards(app, when=None):
+    """Returns [(offset, timezones)] for the shards whose evening run is due."""
+    if when is None:
+        when = datetime.datetime.utcnow()
+    due = []
+    for offset, timezones in sorted(timezone_shards(app, when).items()):
+        local = when + datetime.timedelta(minutes=offset)
+        if local.hour == app.config["HANGOUT_LOCAL_HOUR"] and local.minute < 30:
+            due.append((offset, timezones))
+    return due
+
+def arrange_due_shards(app, when=None):
+    """Arranges hangouts for each shard whose evening run is due."""
+    if when is None:
+        when = datetime.datetime.utcnow()
+    for offset, timezones in due_shards(app, when):
+        logger.info("Arranging hangouts for UTC{}{:02d}:{:02d} ({} timezones)".format(
+            "-" if offset < 0 else "+", abs(offset) // 60, abs(offset) % 60, len(timezones)))
+        wshom.graph.arrange_hangouts(app, local_day(offset, when), timezones=timezones)
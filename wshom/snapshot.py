@@ -0,0 +1,166 @@
+from wshom.model import User, GraphNode, GraphEdge, friendship
+from wshom.extensions import db
+import numpy as np
+import os
+import struct
+import wshom.csr
+import wshom.graph
+
+# Binary snapshots of the friend graph.
+#
+# A snapshot holds a wshom.csr.CSRGraph's arrays, including its adjacency, so
+# loading one maps the file and wraps the arrays without parsing or sorting
+# anything. Workers that map the same file share its pages read-only.
+#
+# Layout (little-endian):
+#
+#     header   magic "WSHOMSNP", version (u32), section count (u32),
+#              day (i64, NO_DAY if none), node count (i64), edge count (i64)
+#     sections (name (24 bytes), dtype (4 bytes), offset (i64), length (i64))
+#              for each section
+#     data     each section's array, starting at a multiple of ALIGNMENT
+#
+# Node ids go in the "labels" section if they are all integers (user ids) and
+# in "names", as newline-separated UTF-8, otherwise (e.g. for friend_graph
+# experiments). Edge ends are node numbers, not ids.
+
+MAGIC = b"WSHOMSNP"
+VERSION = 1
+NO_DAY = -1
+ALIGNMENT = 64
+
+_HEADER = struct.Struct("<8sIIqqq")
+_SECTION = struct.Struct("<24s4s4xqq")
+
+_NODE_SECTIONS = ["min_interval", "points", "saved_last_day"]
+_EDGE_SECTIONS = ["edge_u", "edge_v", "edge_points", "edge_saved_last_day"]
+_ADJACENCY_SECTIONS = ["indptr", "indices", "slot_edge"]
+
+class SnapshotError(Exception):
+    pass
+
+def _aligned(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+def save(path, g):
+    """Writes g (a CSRGraph or a networkx graph) to a snapshot at path.
+
+    The file is written next to path and renamed into place, so readers never
+    see a partial snapshot.
+    """
+    if not isinstance(g, wshom.csr.CSRGraph):
+        g = wshom.csr.from_networkx(g)
+    elif not g.node_mask.all() or not g.edge_kept.all():
+        g = wshom.csr.from_networkx(wshom.csr.to_networkx(g))
+
+    sections = []
+    if all(isinstance(n, (int, np.integer)) for n in g.labels):
+        sections.append(("labels", np.asarray(g.labels, dtype="<i8")))
+    else:
+        sections.append(("names", np.frombuffer("\n".join(str(n) for n in g.labels).encode(), dtype="|u1")))
+    for name in _NODE_SECTIONS + _EDGE_SECTIONS + _ADJACENCY_SECTIONS:
+        sections.append((name, np.asarray(getattr(g, name), dtype="<i8")))
+
+    offset = _aligned(_HEADER.size + _SECTION.size * len(sections))
+    table = []
+    for name, array in sections:
+        table.append(_SECTION.pack(name.encode(), array.dtype.str.encode(), offset, len(array)))
+        offset = _aligned(offset + array.nbytes)
+
+    day = g.graph.get("day")
+    tmp_path = "{}.tmp{}".format(path, os.getpid())
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, len(sections), NO_DAY if day is None else day, len(g.labels), len(g.edge_u)))
+        f.write(b"".join(table))
+        for (name, array), entry in zip(sections, table):
+            f.seek(_SECTION.unpack(entry)[2])
+            f.write(array.tobytes())
+        f.truncate(offset)
+    os.replace(tmp_path, path)
+
+def load(path, writable=False):
+    """Maps the snapshot at path as a CSRGraph.
+
+    The arrays are read-only views of the file unless writable, in which case
+    changes to them (e.g. zero_points) stay private to this process.
+    """
+    data = np.memmap(path, dtype=np.uint8, mode="c" if writable else "r")
+    if len(data) < _HEADER.size:
+        raise SnapshotError("{} is too short to be a snapshot".format(path))
+    magic, version, n_sections, day, n_nodes, n_edges = _HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise SnapshotError("{} is not a snapshot".format(path))
+    if version != VERSION:
+        raise SnapshotError("{} is snapshot version {}, not {}".format(path, version, VERSION))
+
+    arrays = {}
+    for i in range(n_sections):
+        name, dtype, offset, length = _SECTION.unpack_from(data, _HEADER.size + i * _SECTION.size)
+        dtype = np.dtype(dtype.rstrip(b"\0").decode())
+        if offset + length * dtype.itemsize > len(data):
+            raise SnapshotError("{} is truncated".format(path))
+        arrays[name.rstrip(b"\0").decode()] = data[offset:offset + length * dtype.itemsize].view(dtype)
+
+    if "labels" in arrays:
+        labels = arrays["labels"].tolist()
+    else:
+        labels = bytes(arrays["names"]).decode().split("\n") if n_nodes else []
+    return wshom.csr.CSRGraph(labels, *[arrays[name] for name in _NODE_SECTIONS + _EDGE_SECTIONS],
+                              graph={} if day == NO_DAY else {"day": day},
+                              adjacency=[arrays[name] for name in _ADJACENCY_SECTIONS])
+
+def load_networkx(path):
+    return wshom.csr.to_networkx(load(path))
+
+def export_snapshot(app, path, day=None):
+    """Saves the graph arrange_hangouts would load for day to path."""
+    save(path, wshom.graph.csr_graph_from_database(app, day))
+
+def import_snapshot(app, path):
+    """Makes the database's graph match the snapshot at path.
+
+    Users missing from the database are added (with placeholder details and
+    no password), min_interval is set, missing friendships are added both
+    ways and every last day is written. Nothing is removed. Run
+    build_group_index.py afterwards.
+    """
+    cg = load(path, writable=True)
+    if "day" not in cg.graph:
+        raise SnapshotError("{} has no day, so its points can't be saved".format(path))
+    labels = cg.labels
+
+    existing = set(n for (n,) in db.session.query(User.id))
+    new_users = [{
+        "id": n,
+        "username": "user{}".format(n),
+        "email": "user{}@localhost".format(n),
+        "password_hash": "",
+        "active": True,
+        "display_name": "",
+        "timezone": "",
+        "min_interval": int(cg.min_interval[i]),
+    } for (i, n) in enumerate(labels) if n not in existing]
+    if new_users:
+        db.session.execute(User.__table__.insert(), new_users)
+    updates = [{"user_id": n, "min_interval": int(cg.min_interval[i])} for (i, n) in enumerate(labels) if n in existing]
+    if updates:
+        users = User.__table__
+        db.session.execute(users.update().where(users.c.id == db.bindparam("user_id")).values(min_interval=db.bindparam("min_interval")), updates)
+
+    existing = set((u, v) for (u, v) in db.session.query(friendship.c.user_id, friendship.c.friend_id))
+    rows = []
+    for u, v in zip(cg.edge_u.tolist(), cg.edge_v.tolist()):
+        for pair in ((labels[u], labels[v]), (labels[v], labels[u])):
+            if pair not in existing:
+                rows.append({"user_id": pair[0], "friend_id": pair[1]})
+    if rows:
+        db.session.execute(friendship.insert(), rows)
+
+    # Compare against what the database has, so save_csr_graph_to_database
+    # writes every row that differs
+    saved = dict(db.session.query(GraphNode.user_id, GraphNode.last_day))
+    cg.saved_last_day[:] = [saved.get(n, wshom.csr.NO_ROW) for n in labels]
+    saved = {(a, b): last_day for (a, b, last_day) in db.session.query(GraphEdge.user_a_id, GraphEdge.user_b_id, GraphEdge.last_day)}
+    cg.edge_saved_last_day[:] = [saved.get((min(labels[u], labels[v]), max(labels[u], labels[v])), wshom.csr.NO_ROW)
+                                 for (u, v) in zip(cg.edge_u.tolist(), cg.edge_v.tolist())]
+    wshom.graph.save_csr_graph_to_database(app, cg)
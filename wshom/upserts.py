@@ -0,0 +1,44 @@
+from wshom.extensions import db
+from sqlalchemy.dialects import postgresql, sqlite
+
+# Bulk writes that tolerate rows already being there.
+#
+# SQLite and PostgreSQL do it in one executemany with ON CONFLICT. Other
+# databases get a query for the rows that exist and separate statements for
+# the rest, which is only safe while nothing else writes the same rows.
+
+def upsert_last_day(table, key_columns, updates, inserts):
+    """Writes last_day rows with executemany, as upserts where supported."""
+    if not updates and not inserts:
+        return
+    dialect = db.engine.dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        insert = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}[dialect](table)
+        upsert = insert.on_conflict_do_update(index_elements=key_columns, set_={"last_day": insert.excluded.last_day})
+        db.session.execute(upsert, updates + inserts)
+        return
+
+    if updates:
+        where = db.and_(*[table.c[k] == db.bindparam("key_" + k) for k in key_columns])
+        rows = [dict(("key_" + k, v) if k in key_columns else (k, v) for (k, v) in row.items()) for row in updates]
+        db.session.execute(table.update().where(where).values(last_day=db.bindparam("last_day")), rows)
+    if inserts:
+        db.session.execute(table.insert(), inserts)
+
+def insert_ignoring_conflicts(table, key_columns, rows):
+    """Inserts rows with executemany, skipping any whose key_columns match a
+    row already in table.
+    """
+    if not rows:
+        return
+    dialect = db.engine.dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        insert = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}[dialect](table)
+        db.session.execute(insert.on_conflict_do_nothing(index_elements=key_columns), rows)
+        return
+
+    columns = [table.c[k] for k in key_columns]
+    existing = set(tuple(row) for row in db.session.query(*columns).filter(columns[0].in_(set(row[key_columns[0]] for row in rows))))
+    rows = [row for row in rows if tuple(row[k] for k in key_columns) not in existing]
+    if rows:
+        db.session.execute(table.insert(), rows)
@@ -1,10 +1,13 @@
 import flask
 from flask import Blueprint
 import flask_login
-import werkzeug.security
-from wshom.model import User
+import hmac
+from wshom.model import User, friendship
 from wshom.extensions import db, login_manager
+import wshom.cache
 import wshom.forms
+import wshom.friends
+import wshom.passwords
 from flask_login import current_user
 
 blueprint = Blueprint("public", __name__, static_folder="../static")
@@ -16,14 +19,26 @@ def login():
     form = wshom.forms.LoginForm()
     if form.validate_on_submit():
         user = User.query.filter_by(username=form.username.data).first()
-        if user is None or not user.check_password(form.password.data):
+        try:
+            valid = wshom.passwords.check_login(user, form.username.data, form.password.data)
+        except wshom.passwords.Throttled:
+            flask.flash("Too many failed logins, try again later")
+            return flask.render_template("login.html", form=form), 429
+        except wshom.passwords.Busy:
+            return _busy("login.html", form=form)
+        if not valid:
             flask.flash("Invalid username or password")
             return flask.redirect(flask.url_for("public.login"))
         else:
+            db.session.commit() # In case the hash was updated
             flask_login.login_user(user, remember=True)
             return flask.redirect(flask.url_for("public.index"))
     return flask.render_template("login.html", form=form)
 
+def _busy(template, **context):
+    flask.flash("Too many people are logging in right now, try again in a moment")
+    return flask.render_template(template, **context), 503, {"Retry-After": "1"}
+
 @blueprint.route("/logout", methods=["POST"])
 def logout():
     flask_login.logout_user()
@@ -33,7 +48,10 @@ def logout():
 def register():
     form = wshom.forms.RegisterForm()
     if form.validate_on_submit():
-        password_hash = werkzeug.security.generate_password_hash(form.password.data)
+        try:
+            password_hash = wshom.passwords.hash_password(form.password.data)
+        except wshom.passwords.Busy:
+            return _busy("register.html", form=form)
         user = User(username=form.username.data,
                     password_hash=password_hash,
                     email=form.email.data)
@@ -47,7 +65,7 @@ def register():
 
 @login_manager.user_loader
 def load_user(id):
-    return User.query.get(int(id))
+    return wshom.cache.load_user(int(id))
 
 @blueprint.route("/")
 def index():
@@ -60,30 +78,86 @@ def friends():
     delete_friend_form = wshom.forms.DeleteFriendForm()
 
     if add_friend_form.submit_add.data and add_friend_form.validate_on_submit():
-        user = User.query.filter_by(username=add_friend_form.add_username.data).one()
-        current_user.friends.append(user)
+        # The scheduling modules are imported when something changes for them,
+        # not when the web app starts
+        import wshom.groups as groups
+        import wshom.planner as planner
+        user = wshom.cache.user_by_username(add_friend_form.add_username.data)
+        db.session.execute(friendship.insert().values(user_id=current_user.id, friend_id=user.id))
+        if wshom.friends.has_friend(user.id, current_user.id):
+            groups.friendship_added(current_user.id, user.id, flask.current_app.config["HANGOUT_GROUP_SIZE"])
+            planner.invalidate(flask.current_app, [current_user.id, user.id])
         db.session.commit()
 
     if delete_friend_form.submit_delete.data and delete_friend_form.validate_on_submit():
-        user = User.query.filter_by(username=delete_friend_form.delete_username.data).one()
-        current_user.friends.remove(user)
+        import wshom.groups as groups
+        import wshom.planner as planner
+        user = wshom.cache.user_by_username(delete_friend_form.delete_username.data)
+        db.session.execute(friendship.delete().where(db.and_(friendship.c.user_id == current_user.id, friendship.c.friend_id == user.id)))
+        if wshom.friends.has_friend(user.id, current_user.id):
+            groups.friendship_removed(current_user.id, user.id, flask.current_app.config["HANGOUT_GROUP_SIZE"])
+            planner.invalidate(flask.current_app, [current_user.id, user.id])
         db.session.commit()
 
-    friends = current_user.friends
-    delete_friend_forms = [wshom.forms.DeleteFriendForm(delete_username=f.username) for f in friends]
-    return flask.render_template("friends.html", add_friend_form=add_friend_form, friends=zip(friends, delete_friend_forms), delete_friend_form=delete_friend_form)
+    # One query for a page of the list, and one delete form rendered once per
+    # friend
+    friends, next_after = wshom.friends.friends_page(current_user.id, _after_arg(), flask.current_app.config["FRIENDS_PAGE_SIZE"])
+    return flask.render_template("friends.html", add_friend_form=add_friend_form, friends=friends, next_after=next_after, delete_friend_form=delete_friend_form)
+
+@blueprint.route("/friends.json")
+@flask_login.login_required
+def friends_json():
+    config = flask.current_app.config
+    limit = max(1, min(flask.request.args.get("limit", config["FRIENDS_PAGE_SIZE"], type=int), config["FRIENDS_PAGE_MAX"]))
+    friends, next_after = wshom.friends.friends_page(current_user.id, _after_arg(), limit)
+    return flask.jsonify(
+        friends=[{"id": f.id, "username": f.username, "display_name": f.display_name} for f in friends],
+        next=flask.url_for("public.friends_json", after=next_after, limit=limit) if next_after is not None else None)
+
+@blueprint.route("/friends/import", methods=["POST"])
+def import_friends():
+    """Adds friendships in bulk, for an administrator holding
+    FRIENDS_IMPORT_TOKEN. Takes {"pairs": [[username, friend], ...]} and/or
+    {"friends": {username: [friend, ...]}}, and "mutual": true to add each
+    friendship both ways.
+    """
+    config = flask.current_app.config
+    token = config["FRIENDS_IMPORT_TOKEN"]
+    if not token or not hmac.compare_digest(flask.request.headers.get("Authorization", "").encode(), ("Bearer " + token).encode()):
+        flask.abort(403)
+    data = flask.request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get("pairs", []), list) or not isinstance(data.get("friends", {}), dict):
+        flask.abort(400)
+
+    # A friend list that isn't a list or a username becomes one pair that
+    # add_friendships reports as an error
+    pairs = data.get("pairs", []) + [[username, friend]
+        for (username, friends) in data.get("friends", {}).items()
+        for friend in (friends if isinstance(friends, list) else [friends])]
+    if len(pairs) > config["FRIENDS_IMPORT_MAX"]:
+        flask.abort(413)
+    result = wshom.friends.add_friendships(flask.current_app, pairs, bool(data.get("mutual")))
+    for error in result["errors"]:
+        error["pair"] = pairs[error["row"]]
+    return flask.jsonify(result)
+
+def _after_arg():
+    return flask.request.args.get("after", type=int)
 
 @blueprint.route("/profile", methods=["GET", "POST"])
 @flask_login.login_required
 def profile():
     form = wshom.forms.ProfileForm(email=current_user.email, display_name=current_user.display_name, timezone=current_user.timezone, min_interval=current_user.min_interval, active=current_user.active)
     if form.validate_on_submit():
+        import wshom.planner as planner
         current_user.email = form.email.data
         current_user.display_name = form.display_name.data
         current_user.timezone = form.timezone.data
         current_user.min_interval = form.min_interval.data
         current_user.active = form.active.data
+        planner.invalidate(flask.current_app, [current_user.id])
         db.session.commit()
+        wshom.cache.invalidate_user(current_user.id)
         flask.flash("Profile updated")
     return flask.render_template("profile.html", form=form)
 